@@ -0,0 +1,137 @@
+import json
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+
+# Wall time per phase and calls per MO2 interface method of a merge.
+# Calls are counted by proxies in front of IPluginList / IModList, so nothing
+# here calls into MO2 itself. Counting costs one dict update per call.
+
+
+class PhaseReport:
+    def __init__(self, name: str):
+        self.name = name
+        self.ms = 0.0
+        self.calls: Counter = Counter()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "phase": self.name,
+            "ms": round(self.ms, 3),
+            "calls": dict(sorted(self.calls.items())),
+        }
+
+
+class MergeReport:
+    def __init__(self):
+        self.phases: List[PhaseReport] = []
+        # Calls made outside of any phase
+        self.other_calls: Counter = Counter()
+        self.info: Dict[str, Any] = {}
+        self._calls = self.other_calls
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[PhaseReport]:
+        phase = PhaseReport(name)
+        self.phases.append(phase)
+        previous, self._calls = self._calls, phase.calls
+        start = time.perf_counter()
+        try:
+            yield phase
+        finally:
+            phase.ms = (time.perf_counter() - start) * 1000
+            self._calls = previous
+
+    def count(self, method: str):
+        self._calls[method] += 1
+
+    @property
+    def total_ms(self) -> float:
+        return sum(p.ms for p in self.phases)
+
+    @property
+    def total_calls(self) -> int:
+        return sum(sum(p.calls.values()) for p in self.phases) + sum(
+            self.other_calls.values()
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "info": self.info,
+            "total_ms": round(self.total_ms, 3),
+            "total_calls": self.total_calls,
+            "phases": [p.to_dict() for p in self.phases],
+            "other_calls": dict(sorted(self.other_calls.items())),
+        }
+
+    def format(self) -> str:
+        lines = []
+        width = max((len(p.name) for p in self.phases), default=0)
+        for p in self.phases:
+            calls = sum(p.calls.values())
+            lines.append(f"{p.name:<{width}}  {p.ms:>9.1f} ms  {calls:>6} calls")
+            for method, count in sorted(p.calls.items()):
+                lines.append(f"    {count:>6}  {method}")
+        lines.append(
+            f"{'Total':<{width}}  {self.total_ms:>9.1f} ms  {self.total_calls:>6} calls"
+        )
+        return "\n".join(lines)
+
+    def write_json(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(self.to_dict(), indent=4))
+
+
+class CountingProxy:
+    # Forwards everything to target, calls of methods are counted as
+    # "<interface>.<method>" in the current phase of the report
+
+    def __init__(self, target, interface: str, report: MergeReport):
+        self._target = target
+        self._interface = interface
+        self._report = report
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._target, name)
+        if not callable(attr):
+            return attr
+
+        method = f"{self._interface}.{name}"
+        report = self._report
+
+        def counted(*args, **kwargs):
+            report.count(method)
+            return attr(*args, **kwargs)
+
+        # Later lookups find the wrapper without going through __getattr__
+        self.__dict__[name] = counted
+        return counted
+
+
+class InstrumentedOrganizer:
+    # Organizer whose plugin and mod list count their calls
+
+    def __init__(self, organizer, report: MergeReport):
+        self._organizer = organizer
+        self._report = report
+        self._plugin_list = None
+        self._mod_list = None
+
+    def pluginList(self):
+        if self._plugin_list is None:
+            self._plugin_list = CountingProxy(
+                self._organizer.pluginList(), "IPluginList", self._report
+            )
+        return self._plugin_list
+
+    def modList(self):
+        if self._mod_list is None:
+            self._mod_list = CountingProxy(
+                self._organizer.modList(), "IModList", self._report
+            )
+        return self._mod_list
+
+    def __getattr__(self, name: str):
+        return getattr(self._organizer, name)
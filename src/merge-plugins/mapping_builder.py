@@ -0,0 +1,331 @@
+import hashlib
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from .master_cache import MasterCache
+from .master_graph import MasterGraph
+from .plugin_header import scan_plugin_headers
+from .plugin_mapping_store import PluginMappingStore
+from .prepare_merge_settings import PrepareMergeSettings
+
+# Second stage of building a plugin mapping. The first stage reads everything needed
+# from MO2 into a MappingSnapshot on the main thread (snapshot_plugin_mapping_impl),
+# this stage only works on the snapshot and can run on a worker thread.
+
+Progress = Callable[[int, int], None]
+Cancelled = Callable[[], bool]
+
+# Rows between progress reports and cancellation checks
+CHUNK_SIZE = 256
+
+
+class MappingBuildCancelled(Exception):
+    pass
+
+
+class PluginMappingChanges:
+    def __init__(self):
+        self.added: List[str] = []
+        self.removed: List[str] = []
+        self.moved: List[str] = []
+        # Plugins whose masters changed in place
+        self.updated: List[str] = []
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.moved or self.updated)
+
+    def __str__(self):
+        return (
+            f"{len(self.added)} added, {len(self.removed)} removed,"
+            f" {len(self.moved)} moved, {len(self.updated)} updated"
+        )
+
+
+class MappingSnapshot:
+    # Raw MO2 data of a profile
+
+    def __init__(self, profile: str, profile_path: Path):
+        self.profile = profile
+        self.profile_path = profile_path
+        # Plugins with their priority in plugin list order
+        self.plugins: List[Tuple[str, int]] = []
+        # Origin of plugins that are new or may have changed
+        self.origins: Dict[str, str] = {}
+        # Masters of plugins that are new or may have changed, if requested.
+        # Plugins found on disk are listed in plugin_paths instead, their masters
+        # are read from the plugin headers by read_masters.
+        self.masters: Dict[str, List[str]] = {}
+        self.plugin_paths: Dict[str, str] = {}
+        # Plugins in masters that have the master flag
+        self.master_flags: Set[str] = set()
+        self.mod_priorities: Dict[str, int] = {}
+        self.mods_by_priority: List[str] = []
+        self.active_mods: List[str] = []
+        # Entries of the previous mapping by plugin name
+        self.previous: Dict[str, Tuple[int, str, int, str]] = {}
+
+
+class MappingBuild:
+    def __init__(
+        self,
+        profile: str,
+        mapping: PluginMappingStore,
+        master_graph: MasterGraph,
+        changes: PluginMappingChanges,
+        fingerprint: str,
+        data: bytes,
+        unreadable: Optional[Dict[str, str]] = None,
+        active_mods: Optional[List[str]] = None,
+    ):
+        self.profile = profile
+        self.mapping = mapping
+        self.master_graph = master_graph
+        self.changes = changes
+        self.fingerprint = fingerprint
+        # Serialized settings, ready to be written
+        self.data = data
+        # Plugins with a header that could not be read, with the reason
+        self.unreadable = unreadable if unreadable is not None else {}
+        self.active_mods = active_mods
+
+
+def mapping_fingerprint(
+    plugin_names: Iterable[str], mods_by_priority: Iterable[str], profile_path: Path
+) -> str:
+    fingerprint = hashlib.sha1()
+    for plugin in sorted(plugin_names):
+        fingerprint.update(plugin.encode())
+        fingerprint.update(b"\0")
+    fingerprint.update(b"\1")
+    for mod in mods_by_priority:
+        fingerprint.update(mod.encode())
+        fingerprint.update(b"\0")
+
+    # Plugin priorities and mod states are only covered by the profile files
+    for name in ("modlist.txt", "loadorder.txt", "plugins.txt"):
+        fingerprint.update(b"\1")
+        try:
+            stat = (profile_path / name).stat()
+            fingerprint.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+        except OSError:
+            pass
+
+    return fingerprint.hexdigest()
+
+
+def _check(
+    done: int, total: int, progress: Optional[Progress], cancelled: Optional[Cancelled]
+):
+    if cancelled is not None and cancelled():
+        raise MappingBuildCancelled()
+    if progress is not None:
+        progress(done, total)
+
+
+def build_plugin_mapping(
+    snapshot: MappingSnapshot,
+    progress: Optional[Progress] = None,
+    cancelled: Optional[Cancelled] = None,
+) -> Tuple[PluginMappingStore, PluginMappingChanges]:
+    previous = dict(snapshot.previous)
+    changes = PluginMappingChanges()
+    data = PluginMappingStore()
+
+    total = len(snapshot.plugins)
+    for idx, (plugin, priority) in enumerate(snapshot.plugins):
+        if idx % CHUNK_SIZE == 0:
+            _check(idx, total, progress, cancelled)
+
+        entry = previous.pop(plugin, None)
+        mod = snapshot.origins.get(plugin)
+        # Unchanged plugin in an unchanged mod -> reuse the stored entry
+        if mod is None and entry is not None:
+            data.append(*entry)
+            continue
+
+        new_entry = (priority, plugin, snapshot.mod_priorities[mod], mod)
+        data.append(*new_entry)
+        if new_entry == entry:
+            # Origin queried again, but nothing changed
+            continue
+        if entry is None:
+            changes.added.append(plugin)
+        else:
+            changes.moved.append(plugin)
+
+    changes.removed.extend(previous.keys())
+
+    return data, changes
+
+
+def read_masters(
+    snapshot: MappingSnapshot,
+    progress: Optional[Progress] = None,
+    cancelled: Optional[Cancelled] = None,
+    cache: Optional[MasterCache] = None,
+) -> Dict[str, str]:
+    # Moves the plugins of snapshot.plugin_paths to snapshot.masters, returns the
+    # plugins whose header could not be read
+    def report(done: int, total: int):
+        _check(done, total, progress, cancelled)
+
+    if cache is not None:
+        headers, errors = cache.headers(snapshot.plugin_paths.values(), report)
+    else:
+        headers, errors = scan_plugin_headers(snapshot.plugin_paths.values(), report)
+
+    unreadable = {}
+    for plugin, path in snapshot.plugin_paths.items():
+        header = headers.get(path)
+        if header is not None:
+            snapshot.masters[plugin] = list(header.masters)
+            if header.is_master:
+                snapshot.master_flags.add(plugin)
+        else:
+            unreadable[plugin] = errors.get(path, "")
+    snapshot.plugin_paths = {}
+    return unreadable
+
+
+def build_master_graph(
+    snapshot: MappingSnapshot,
+    graph: Optional[MasterGraph],
+    mapping: PluginMappingStore,
+    changes: PluginMappingChanges,
+    progress: Optional[Progress] = None,
+    cancelled: Optional[Cancelled] = None,
+) -> MasterGraph:
+    # Updates the graph in place, a new graph is built from all masters of the snapshot.
+    # Plugins without masters in the snapshot (unreadable headers) are left out, the
+    # planner then lists them as unresolved and their masters are queried from MO2.
+    if graph is None:
+        graph = MasterGraph()
+        changed: Optional[Set[str]] = None
+    else:
+        for plugin in changes.removed:
+            graph.remove(plugin)
+        changed = set(changes.added)
+        changed.update(changes.moved)
+
+    total = len(mapping)
+    for idx, (_, plugin, _, mod) in enumerate(mapping):
+        if idx % CHUNK_SIZE == 0:
+            _check(idx, total, progress, cancelled)
+        if changed is not None and plugin not in changed:
+            continue
+        masters = snapshot.masters.get(plugin)
+        if masters is not None:
+            graph.add(plugin, masters, mod, plugin in snapshot.master_flags)
+        else:
+            graph.remove(plugin)
+
+    return graph
+
+
+def update_masters(
+    graph: MasterGraph,
+    mapping: PluginMappingStore,
+    changes: PluginMappingChanges,
+    cache: MasterCache,
+    progress: Optional[Progress] = None,
+    cancelled: Optional[Cancelled] = None,
+) -> Dict[str, str]:
+    # Plugins kept from the previous mapping may have been changed in place. Their
+    # cached files are checked (one stat each) and only changed files are read again.
+    # Returns the plugins whose header could not be read.
+    def report(done: int, total: int):
+        _check(done, total, progress, cancelled)
+
+    changed = set(changes.added)
+    changed.update(changes.moved)
+    paths = cache.paths(
+        (plugin, mod)
+        for _, plugin, _, mod in mapping
+        if plugin not in changed and plugin in graph
+    )
+    headers, errors = cache.headers(paths.values(), report)
+
+    unreadable = {}
+    for _, plugin, _, mod in mapping:
+        path = paths.get(plugin)
+        if path is None:
+            continue
+        header = headers.get(path)
+        if header is None:
+            graph.remove(plugin)
+            unreadable[plugin] = errors.get(path, "")
+        elif header.is_master != graph.has_master_flag(plugin) or [
+            MasterGraph.key(m) for m in header.masters
+        ] != [MasterGraph.key(m) for m in graph.masters(plugin)]:
+            graph.add(plugin, header.masters, mod, header.is_master)
+            changes.updated.append(plugin)
+    return unreadable
+
+
+def build_settings(
+    snapshot: MappingSnapshot,
+    graph: Optional[MasterGraph],
+    progress: Optional[Progress] = None,
+    cancelled: Optional[Cancelled] = None,
+    cache: Optional[MasterCache] = None,
+) -> MappingBuild:
+    # Mapping, master graph, indexes, fingerprint and serialized settings.
+    # graph: copy of the previous master graph to update, owned by the build
+    # cache: masters of plugin files read before, updated by the build
+    headers = len(snapshot.plugin_paths)
+    # Files of an updated graph are checked against the cache
+    checked = len(snapshot.plugins) if graph is not None and cache is not None else 0
+    total = headers + checked + 2 * len(snapshot.plugins) + 1
+
+    def report(offset: int) -> Optional[Progress]:
+        if progress is None:
+            return None
+        return lambda done, _: progress(offset + done, total)
+
+    unreadable = read_masters(snapshot, report(0), cancelled, cache)
+    mapping, changes = build_plugin_mapping(snapshot, report(headers), cancelled)
+    if checked > 0:
+        unreadable.update(
+            update_masters(
+                graph,
+                mapping,
+                changes,
+                cache,
+                report(headers + len(snapshot.plugins)),
+                cancelled,
+            )
+        )
+    graph = build_master_graph(
+        snapshot,
+        graph,
+        mapping,
+        changes,
+        report(headers + checked + len(snapshot.plugins)),
+        cancelled,
+    )
+
+    fingerprint = mapping_fingerprint(
+        (p for p, _ in snapshot.plugins),
+        snapshot.mods_by_priority,
+        snapshot.profile_path,
+    )
+    # Indexes are built here, not on first use in the GUI
+    mapping.build_indexes()
+    _check(total - 1, total, progress, cancelled)
+
+    settings = PrepareMergeSettings(mapping, snapshot.profile, fingerprint)
+    settings.master_graph = graph
+    settings.active_mods = snapshot.active_mods
+    data = settings.to_bytes()
+    _check(total, total, progress, cancelled)
+
+    return MappingBuild(
+        snapshot.profile,
+        mapping,
+        graph,
+        changes,
+        fingerprint,
+        data,
+        unreadable,
+        snapshot.active_mods,
+    )
@@ -0,0 +1,61 @@
+from pathlib import Path
+from typing import Optional
+
+try:
+    import PyQt6.QtCore as QtCore
+    from PyQt6.QtCore import pyqtSignal
+except ImportError:
+    import PyQt5.QtCore as QtCore
+    from PyQt5.QtCore import pyqtSignal
+
+from .mapping_builder import MappingBuildCancelled, MappingSnapshot, build_settings
+from .master_cache import MasterCache
+from .master_graph import MasterGraph
+
+
+class MappingBuildWorker(QtCore.QThread):
+    # Builds a mapping from a snapshot off the GUI thread.
+    # The result is only handed over through the built signal, nothing shared with
+    # the GUI is modified here.
+
+    progress = pyqtSignal(int, int)
+    built = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+    def __init__(
+        self,
+        snapshot: MappingSnapshot,
+        master_graph: Optional[MasterGraph] = None,
+        master_cache: Optional[MasterCache] = None,
+        master_cache_path: Optional[Path] = None,
+        parent=None,
+    ):
+        super().__init__(parent)
+        self._snapshot = snapshot
+        # Copy owned by the worker, updated in place
+        self._master_graph = master_graph
+        # Only used by one worker at a time, stored once the build is done
+        self._master_cache = master_cache
+        self._master_cache_path = master_cache_path
+
+    def run(self):
+        try:
+            result = build_settings(
+                self._snapshot,
+                self._master_graph,
+                self.progress.emit,
+                self.isInterruptionRequested,
+                self._master_cache,
+            )
+            if (
+                self._master_cache is not None
+                and self._master_cache.modified
+                and self._master_cache_path is not None
+            ):
+                self._master_cache.write_file(self._master_cache_path)
+        except MappingBuildCancelled:
+            return
+        except Exception as ex:
+            self.failed.emit(repr(ex))
+            return
+        self.built.emit(result)
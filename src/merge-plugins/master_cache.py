@@ -0,0 +1,213 @@
+import os
+from pathlib import Path, PureWindowsPath
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from .master_graph import MasterGraph
+from .plugin_header import PluginHeader, scan_plugin_headers
+from .plugin_mapping_store import PluginMappingStore
+from .prepare_merge_settings import (
+    STRING_OFFSETS,
+    STRINGS,
+    StringTable,
+    _to_array,
+    _to_bytes,
+    pack_sections,
+    pack_strings,
+    unpack_sections,
+)
+
+# Masters of plugin files, stored next to the settings. Entries are keyed by the
+# path of the plugin and only valid as long as size and modification time of the
+# file match, so headers of unchanged files are never read again.
+#
+# File layout as in prepare_merge_settings, with these sections:
+#   PATH: string id of the path of every entry
+#   SIZE, MTIM: file size and modification time (ns)
+#   FLAG: header flags
+#   MOFF, MAST: MAST[MOFF[i] : MOFF[i + 1]] are the string ids of the masters of entry i
+MAGIC = b"PMMC"
+PATHS = b"PATH"
+SIZES = b"SIZE"
+MTIMES = b"MTIM"
+FLAGS = b"FLAG"
+MASTER_OFFSETS = b"MOFF"
+MASTERS = b"MAST"
+
+# (size, mtime, header)
+CacheEntry = Tuple[int, int, PluginHeader]
+
+
+class MasterCache:
+    VERSION = (1, 0, 0)
+
+    def __init__(self):
+        self._entries: Dict[str, CacheEntry] = {}
+        self.modified = False
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, path):
+        return str(path) in self._entries
+
+    def lookup(self, path) -> Optional[PluginHeader]:
+        # Header of an unchanged file, entries of changed or removed files are dropped
+        path = str(path)
+        entry = self._entries.get(path)
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            stat = None
+        if stat is None or (stat.st_size, stat.st_mtime_ns) != entry[:2]:
+            del self._entries[path]
+            self.modified = True
+            return None
+        return entry[2]
+
+    def headers(
+        self,
+        paths: Iterable[str],
+        progress: Optional[Callable[[int, int], None]] = None,
+    ) -> Tuple[Dict[str, PluginHeader], Dict[str, str]]:
+        # Like scan_plugin_headers, only files that are not cached or changed are read
+        headers: Dict[str, PluginHeader] = {}
+        stale = []
+        for path in dict.fromkeys(str(p) for p in paths):
+            header = self.lookup(path)
+            if header is not None:
+                headers[path] = header
+            else:
+                stale.append(path)
+
+        cached = len(headers)
+
+        def report(done: int, total: int):
+            if progress is not None:
+                progress(cached + done, cached + total)
+
+        # Stat before reading, a file changed while it is read is read again next time
+        stats = {}
+        for path in stale:
+            try:
+                stat = os.stat(path)
+                stats[path] = (stat.st_size, stat.st_mtime_ns)
+            except OSError:
+                pass
+
+        read, errors = scan_plugin_headers(stale, report)
+        for path, header in read.items():
+            headers[path] = header
+            if path in stats:
+                self._entries[path] = stats[path] + (header,)
+                self.modified = True
+
+        return headers, errors
+
+    def paths(self, plugins: Iterable[Tuple[str, str]]) -> Dict[str, str]:
+        # Cached paths of (plugin, mod) pairs, matched by file name and mod folder.
+        # Files are not checked, the cache may be from another machine.
+        by_name: Dict[str, List[Tuple[str, str]]] = {}
+        for path in self._entries:
+            # Accepts both separators, caches written on Windows are read on Linux
+            file = PureWindowsPath(path)
+            by_name.setdefault(file.name.casefold(), []).append(
+                (file.parent.name.casefold(), path)
+            )
+
+        paths = {}
+        for plugin, mod in plugins:
+            candidates = by_name.get(plugin.casefold())
+            if not candidates:
+                continue
+            path = next(
+                (p for folder, p in candidates if folder == mod.casefold()),
+                candidates[0][1] if len(candidates) == 1 else None,
+            )
+            if path is not None:
+                paths[plugin] = path
+        return paths
+
+    def fill_graph(self, graph: MasterGraph, mapping: PluginMappingStore) -> int:
+        # Adds plugins of the mapping that are missing in the graph.
+        # Returns the number of plugins added.
+        paths = self.paths(
+            (plugin, mod) for _, plugin, _, mod in mapping if plugin not in graph
+        )
+        for _, plugin, _, mod in mapping:
+            if plugin in paths:
+                header = self._entries[paths[plugin]][2]
+                graph.add(plugin, header.masters, mod, header.is_master)
+        return len(paths)
+
+    def from_bytes(self, data) -> bool:
+        sections = unpack_sections(data, MAGIC, self.VERSION[0])
+        if sections is None:
+            return False
+        try:
+            strings = StringTable(
+                _to_array("I", sections[STRING_OFFSETS]), sections[STRINGS]
+            )
+            paths = _to_array("I", sections[PATHS])
+            flags = _to_array("I", sections[FLAGS])
+            offsets = _to_array("I", sections[MASTER_OFFSETS])
+            masters = _to_array("I", sections[MASTERS])
+            sizes = _to_array("q", sections[SIZES])
+            mtimes = _to_array("q", sections[MTIMES])
+            entries = {}
+            for i, (size, mtime) in enumerate(zip(sizes, mtimes)):
+                header = PluginHeader(
+                    [strings[m] for m in masters[offsets[i] : offsets[i + 1]]],
+                    flags[i],
+                )
+                entries[strings[paths[i]]] = (size, mtime, header)
+        except (KeyError, IndexError, TypeError, ValueError, UnicodeDecodeError):
+            # Truncated or corrupt file
+            return False
+        self._entries = entries
+        self.modified = False
+        return True
+
+    def to_bytes(self) -> bytes:
+        string_ids: Dict[str, int] = {}
+
+        def string_id(s: str) -> int:
+            if s not in string_ids:
+                string_ids[s] = len(string_ids)
+            return string_ids[s]
+
+        paths = []
+        flags = []
+        master_offsets = [0]
+        masters = []
+        for path, (_, _, header) in self._entries.items():
+            paths.append(string_id(path))
+            flags.append(header.flags)
+            masters.extend(string_id(m) for m in header.masters)
+            master_offsets.append(len(masters))
+
+        string_offsets, string_blob = pack_strings(list(string_ids))
+        sections = [
+            (STRING_OFFSETS, string_offsets),
+            (STRINGS, string_blob),
+            (PATHS, _to_bytes("I", paths)),
+            (SIZES, _to_bytes("q", (e[0] for e in self._entries.values()))),
+            (MTIMES, _to_bytes("q", (e[1] for e in self._entries.values()))),
+            (FLAGS, _to_bytes("I", flags)),
+            (MASTER_OFFSETS, _to_bytes("I", master_offsets)),
+            (MASTERS, _to_bytes("I", masters)),
+        ]
+        return pack_sections(MAGIC, self.VERSION, sections)
+
+    def read_file(self, path: Path) -> bool:
+        try:
+            data = path.read_bytes()
+        except OSError:
+            return False
+        return self.from_bytes(data)
+
+    def write_file(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(self.to_bytes())
+        self.modified = False
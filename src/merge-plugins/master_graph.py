@@ -0,0 +1,114 @@
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Optional, Set, Tuple
+
+
+class MasterGraph:
+    # Plugins of the base profile with their masters and owning mod.
+    # Plugin names are compared case-insensitively, like the game does.
+
+    MEMO_LIMIT = 1024
+
+    def __init__(self):
+        self._names: Dict[str, str] = {}
+        self._masters: Dict[str, Tuple[str, ...]] = {}
+        self._mods: Dict[str, str] = {}
+        # Plugins with the master (ESM) flag in their header
+        self._master_flags: Set[str] = set()
+        self._closures: Dict[str, FrozenSet[str]] = {}
+
+    @staticmethod
+    def key(plugin: str) -> str:
+        return plugin.casefold()
+
+    def __len__(self):
+        return len(self._mods)
+
+    def __contains__(self, plugin: str):
+        return self.key(plugin) in self._mods
+
+    def __iter__(self) -> Iterator[str]:
+        for k in self._mods:
+            yield self._names[k]
+
+    def copy(self) -> "MasterGraph":
+        graph = MasterGraph()
+        graph._names = dict(self._names)
+        graph._masters = dict(self._masters)
+        graph._mods = dict(self._mods)
+        graph._master_flags = set(self._master_flags)
+        return graph
+
+    def add(
+        self, plugin: str, masters: Iterable[str], mod: str, master_flag: bool = False
+    ):
+        k = self.key(plugin)
+        self._names[k] = plugin
+        self._mods[k] = mod
+        if master_flag:
+            self._master_flags.add(k)
+        else:
+            self._master_flags.discard(k)
+        master_keys = []
+        for m in masters:
+            mk = self.key(m)
+            self._names.setdefault(mk, m)
+            master_keys.append(mk)
+        self._masters[k] = tuple(master_keys)
+        self._closures.clear()
+
+    def remove(self, plugin: str):
+        k = self.key(plugin)
+        if self._mods.pop(k, None) is not None:
+            del self._masters[k]
+            self._master_flags.discard(k)
+            self._closures.clear()
+
+    def has_master_flag(self, plugin: str) -> bool:
+        return self.key(plugin) in self._master_flags
+
+    def loads_as_master(self, plugin: str) -> bool:
+        # MO2 keeps these plugins in front of all other plugins
+        k = self.key(plugin)
+        return k in self._master_flags or k.endswith((".esm", ".esl"))
+
+    def mod(self, plugin: str) -> Optional[str]:
+        return self._mods.get(self.key(plugin))
+
+    def masters(self, plugin: str) -> List[str]:
+        return [self._names[m] for m in self._masters.get(self.key(plugin), ())]
+
+    def closure(self, plugins: Iterable[str]) -> Set[str]:
+        # All plugins and their (transitive) masters
+        result: Set[str] = set()
+        for p in plugins:
+            k = self.key(p)
+            self._names.setdefault(k, p)
+            # Closure of a plugin inside the result is already part of it
+            if k not in result:
+                result.update(self._closure(k, result))
+        return set(self._names.get(k, k) for k in result)
+
+    def _closure(self, key: str, known: Set[str]) -> FrozenSet[str]:
+        if key in self._closures:
+            return self._closures[key]
+
+        closure = {key}
+        to_check = [key]
+        pruned = False
+        while to_check:
+            for m in self._masters.get(to_check.pop(), ()):
+                if m in closure:
+                    continue
+                if m in known:
+                    pruned = True
+                elif m in self._closures:
+                    closure.update(self._closures[m])
+                else:
+                    closure.add(m)
+                    to_check.append(m)
+
+        closure = frozenset(closure)
+        # Memoizing every closure of a deep master chain would need quadratic
+        # memory, and pruned closures are incomplete
+        if not pruned and len(closure) <= self.MEMO_LIMIT:
+            self._closures[key] = closure
+        return closure
@@ -0,0 +1,269 @@
+import heapq
+from itertools import chain
+from typing import Callable, Dict, List, Mapping, Optional, Sequence, Set, Tuple, Union
+
+from .master_graph import MasterGraph
+from .plugin_mapping_store import PluginMappingStore
+
+
+class MergePlan:
+    # Everything a merge will change, computed without touching MO2
+
+    def __init__(self, plugins: List[str], plugin_to_mod: Mapping[str, str]):
+        # Selected plugins in their target load order
+        self.plugins = plugins
+        # Mods containing the selected plugins
+        self.plugin_mods: List[str] = []
+        # Additional mods containing their masters
+        self.master_mods: List[str] = []
+        # Selected plugins and all their masters
+        self.plugins_to_activate: List[str] = []
+        # Selected plugins of the base profile in the order they are placed, masters
+        # before dependents
+        self.load_order: List[str] = plugins
+        # Predicted priority of every selected plugin at the end of the load order
+        self.priorities: Dict[str, int] = {}
+        # (plugin, other plugin) pairs that cannot be ordered as requested: the other
+        # plugin is placed behind the plugin, but is one of its masters or a plugin
+        # with the master flag that MO2 keeps in front of regular plugins
+        self.conflicts: List[Tuple[str, str]] = []
+        # Plugins and masters that are not part of the base profile
+        self.missing: List[str] = []
+        # Plugins of the base profile without known masters
+        self.unresolved: List[str] = []
+        self.plugin_to_mod = plugin_to_mod
+
+    @property
+    def mods(self) -> List[str]:
+        return self.plugin_mods + self.master_mods
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "plugins": self.plugins,
+            "mods": self.mods,
+            "plugin_mods": self.plugin_mods,
+            "master_mods": self.master_mods,
+            "plugins_to_activate": self.plugins_to_activate,
+            "load_order": self.load_order,
+            "priorities": self.priorities,
+            "conflicts": [list(c) for c in self.conflicts],
+            "missing": self.missing,
+            "unresolved": self.unresolved,
+        }
+
+
+class BatchPlan:
+    # Plans of several merges of the same base profile
+
+    def __init__(self):
+        self.plans: Dict[str, MergePlan] = {}
+        # Plugins selected in more than one merge, with the names of those merges
+        self.overlaps: Dict[str, List[str]] = {}
+
+    @property
+    def missing(self) -> Dict[str, List[str]]:
+        return dict((name, p.missing) for name, p in self.plans.items() if p.missing)
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "groups": dict((name, p.to_dict()) for name, p in self.plans.items()),
+            "overlaps": self.overlaps,
+            "missing": self.missing,
+        }
+
+
+class MergePlanner:
+    def __init__(
+        self,
+        mapping: Sequence[Tuple[int, str, int, str]],
+        master_graph: Union[MasterGraph, Callable[[], MasterGraph], None] = None,
+    ):
+        # master_graph: a callable is only called by the first plan, e.g. to build
+        # the graph of stored settings when it is needed
+        if not isinstance(mapping, PluginMappingStore):
+            mapping = PluginMappingStore(mapping)
+        # Plugin and mod lookups use the indexes of the store
+        self._mapping = mapping
+        self._graph_source = master_graph
+        self._graph: Optional[MasterGraph] = None
+        # Plugins outside of the mod list, like the plugins of the game
+        self._unmanaged_plugins: Optional[List[str]] = None
+
+    @property
+    def _master_graph(self) -> MasterGraph:
+        if self._graph is None:
+            source = self._graph_source
+            if source is None:
+                self._graph = MasterGraph()
+            elif isinstance(source, MasterGraph):
+                self._graph = source
+            else:
+                self._graph = source()
+            self._graph_source = None
+        return self._graph
+
+    def plan(self, plugins: List[str]) -> MergePlan:
+        plugin_to_mod = self._mapping.plugin_to_mod
+        managed_plugin_count = self._mapping.managed_plugin_count
+        graph = self._master_graph
+        plan = MergePlan(list(plugins), plugin_to_mod)
+
+        required = graph.closure(plugins)
+        selected = set(MasterGraph.key(p) for p in plugins)
+
+        mods = set()
+        for p in plugins:
+            m = plugin_to_mod.get(p)
+            if m is None:
+                plan.missing.append(p)
+            elif m not in mods and managed_plugin_count(m) > 0:
+                mods.add(m)
+                plan.plugin_mods.append(m)
+
+        for p in sorted(required, key=str.lower):
+            is_master = MasterGraph.key(p) not in selected
+            m = plugin_to_mod.get(p)
+            if m is None:
+                if is_master:
+                    plan.missing.append(p)
+                continue
+            if is_master and m not in mods and managed_plugin_count(m) > 0:
+                mods.add(m)
+                plan.master_mods.append(m)
+            if p not in graph:
+                plan.unresolved.append(p)
+            plan.plugins_to_activate.append(p)
+
+        # Plugins of all enabled mods are part of the load order afterwards
+        plugin_count = self._mapping.unmanaged_plugin_count() + sum(
+            managed_plugin_count(m) for m in mods
+        )
+        # Missing plugins are not placed and take no place in the load order
+        missing = set(plan.missing)
+        plan.load_order = [p for p in plan.plugins if p not in missing]
+        plan.conflicts = self._conflicts(plan.load_order, required)
+        if len(plan.conflicts) > 0:
+            plan.load_order = self._load_order(plan.load_order)
+        plan.conflicts.extend(self._master_flag_conflicts(plan.load_order, mods))
+
+        first_priority = plugin_count - len(plan.load_order)
+        for idx, p in enumerate(plan.load_order):
+            plan.priorities[p] = first_priority + idx
+
+        return plan
+
+    def plan_groups(self, groups: Mapping[str, List[str]]) -> BatchPlan:
+        # All groups are planned against the same master graph, so closures memoized
+        # for one group are reused by the others
+        batch = BatchPlan()
+        selected_by: Dict[str, List[str]] = {}
+        names: Dict[str, str] = {}
+        for name, plugins in groups.items():
+            batch.plans[name] = self.plan(plugins)
+            for p in plugins:
+                k = MasterGraph.key(p)
+                names.setdefault(k, p)
+                group_names = selected_by.setdefault(k, [])
+                if name not in group_names:
+                    group_names.append(name)
+
+        for k, group_names in selected_by.items():
+            if len(group_names) > 1:
+                batch.overlaps[names[k]] = group_names
+        return batch
+
+    def _conflicts(self, plugins: List[str], required: Set[str]):
+        graph = self._master_graph
+        order = dict((MasterGraph.key(p), idx) for idx, p in enumerate(plugins))
+
+        conflicts = []
+        # A selected master placed behind a selected plugin depending on it
+        for idx, p in enumerate(plugins):
+            for m in graph.masters(p):
+                if order.get(MasterGraph.key(m), -1) > idx:
+                    conflicts.append((p, m))
+
+        # Other active plugins depending on a selected plugin would load before it
+        for p in sorted(required, key=str.lower):
+            if MasterGraph.key(p) in order:
+                continue
+            for m in graph.masters(p):
+                if MasterGraph.key(m) in order:
+                    conflicts.append((p, m))
+
+        return conflicts
+
+    def _master_flag_conflicts(
+        self, load_order: List[str], mods: Set[str]
+    ) -> List[Tuple[str, str]]:
+        # MO2 does not move plugins with the master flag (or .esm / .esl) behind
+        # regular plugins. Placed at the end of the load order, they follow all other
+        # plugins of the enabled mods and the selected plugins in front of them.
+        graph = self._master_graph
+        if not any(graph.loads_as_master(p) for p in load_order):
+            return []
+
+        if self._unmanaged_plugins is None:
+            self._unmanaged_plugins = [
+                plugin
+                for _, plugin, priority_mod, _ in self._mapping
+                if priority_mod < 0
+            ]
+        selected = set(MasterGraph.key(p) for p in load_order)
+        other_plugins = chain(
+            self._unmanaged_plugins,
+            (
+                self._mapping.plugin(row)
+                for m in mods
+                for row in self._mapping.rows_of_mod(m)
+            ),
+        )
+        regular = next(
+            (
+                p
+                for p in other_plugins
+                if MasterGraph.key(p) not in selected and not graph.loads_as_master(p)
+            ),
+            None,
+        )
+
+        conflicts = []
+        for p in load_order:
+            if graph.loads_as_master(p):
+                if regular is not None:
+                    conflicts.append((regular, p))
+            elif regular is None:
+                regular = p
+        return conflicts
+
+    def _load_order(self, plugins: List[str]) -> List[str]:
+        # Stable topological order: selected plugins keep their requested order
+        # unless one of their selected masters has to be placed before them
+        graph = self._master_graph
+        order = dict((MasterGraph.key(p), idx) for idx, p in enumerate(plugins))
+
+        dependents: List[List[int]] = [[] for _ in plugins]
+        master_counts = [0] * len(plugins)
+        for idx, p in enumerate(plugins):
+            for m in set(MasterGraph.key(m) for m in graph.masters(p)):
+                m_idx = order.get(m)
+                if m_idx is not None and m_idx != idx:
+                    dependents[m_idx].append(idx)
+                    master_counts[idx] += 1
+
+        ready = [idx for idx, count in enumerate(master_counts) if count == 0]
+        heapq.heapify(ready)
+        load_order = []
+        while ready:
+            idx = heapq.heappop(ready)
+            load_order.append(plugins[idx])
+            for d in dependents[idx]:
+                master_counts[d] -= 1
+                if master_counts[d] == 0:
+                    heapq.heappush(ready, d)
+
+        # Cyclic masters cannot be ordered, leave them as requested
+        if len(load_order) < len(plugins):
+            placed = set(load_order)
+            load_order.extend(p for p in plugins if p not in placed)
+        return load_order
@@ -1,10 +1,13 @@
 # based on https://stackoverflow.com/a/57845903
 import re
+from typing import Dict, Optional, Set
 
 try:
-    from PyQt6.QtCore import Qt, QSortFilterProxyModel
+    from PyQt6.QtCore import Qt, QModelIndex, QSortFilterProxyModel
 except ImportError:
-    from PyQt5.QtCore import Qt, QSortFilterProxyModel
+    from PyQt5.QtCore import Qt, QModelIndex, QSortFilterProxyModel
+
+from .ngram_index import NGramIndex
 
 
 class MultiFilterMode:
@@ -13,30 +16,112 @@ class MultiFilterMode:
 
 
 class MultiFilterProxyModel(QSortFilterProxyModel):
+    # Text filters are case-insensitive substring filters answered from an n-gram
+    # index of the filtered columns. Regex filters scan every row.
+
     def __init__(self, *args, **kwargs):
         QSortFilterProxyModel.__init__(self, *args, **kwargs)
         self.filters = {}
         self.multi_filter_mode = MultiFilterMode.AND
+        self.regex_mode = False
+        self._indexes: Dict[int, NGramIndex] = {}
+        self._matches: Dict[int, Optional[Set[int]]] = {}
+        self._narrow: Dict[int, Set[int]] = {}
 
     def setMultiFilterMode(self, mode):
         self.multi_filter_mode = mode
 
-    def setFilterByColumn(self, column, regex):
+    def setRegexMode(self, enabled: bool):
+        self.regex_mode = enabled
+
+    def setSourceModel(self, source_model):
+        # Connected before the proxy itself, so the filter sees the new rows
+        for signal in (
+            source_model.modelReset,
+            source_model.layoutChanged,
+            source_model.rowsInserted,
+            source_model.rowsRemoved,
+            source_model.rowsMoved,
+        ):
+            signal.connect(self._clear_indexes)
+        QSortFilterProxyModel.setSourceModel(self, source_model)
+
+    def _clear_indexes(self, *args):
+        self._indexes.clear()
+        self._matches.clear()
+        self._narrow.clear()
+
+    def _set_filter(self, column, regex) -> bool:
         try:
-            if isinstance(regex, str):
+            if isinstance(regex, str) and self.regex_mode:
                 regex = re.compile(".*" + regex + ".*", flags=re.IGNORECASE)
-            self.filters[column] = regex
         except re.error:
-            pass
-        self.invalidateFilter()
+            return False
 
-    def clearFilter(self, column):
-        del self.filters[column]
-        self.invalidateFilter()
+        previous = self.filters.get(column)
+        if previous == regex:
+            return False
+        self.filters[column] = regex
+
+        matches = self._matches.pop(column, None)
+        # Refining a text filter can only remove rows, so only the rows accepted
+        # before have to be checked again
+        if (
+            matches is not None
+            and isinstance(previous, str)
+            and isinstance(regex, str)
+            and previous.casefold() in regex.casefold()
+        ):
+            self._narrow[column] = matches
+        else:
+            self._narrow.pop(column, None)
+        return True
+
+    def _invalidate(self):
+        # Only rows are filtered, columns do not have to be checked again (Qt >= 6)
+        if hasattr(self, "invalidateRowsFilter"):
+            self.invalidateRowsFilter()
+        else:
+            self.invalidateFilter()
+
+    def setFilters(self, filters: Dict):
+        # Several column filters with a single re-filtering of the rows
+        changed = False
+        for column, regex in filters.items():
+            changed |= self._set_filter(column, regex)
+        if changed:
+            self._invalidate()
 
     def clearFilters(self):
         self.filters = {}
-        self.invalidateFilter()
+        self._matches.clear()
+        self._narrow.clear()
+        self._invalidate()
+
+    def _text(self, source_row, column, source_parent):
+        index = self.sourceModel().index(source_row, column, source_parent)
+        if index.isValid():
+            text = self.sourceModel().data(index, Qt.ItemDataRole.DisplayRole)
+            if text is not None:
+                return str(text)
+        return ''
+
+    def _column_matches(self, column) -> Optional[Set[int]]:
+        # Source rows containing the filter text, None if all rows do
+        if column not in self._matches:
+            text = self.filters[column]
+            if len(text) == 0:
+                self._matches[column] = None
+            else:
+                if column not in self._indexes:
+                    self._indexes[column] = NGramIndex(
+                        self._text(row, column, QModelIndex())
+                        for row in range(self.sourceModel().rowCount())
+                    )
+                self._matches[column] = self._indexes[column].search(
+                    text, self._narrow.pop(column, None)
+                )
+        return self._matches[column]
 
     def filterAcceptsRow(self, source_row, source_parent):
         if not self.filters:
@@ -44,13 +129,12 @@ class MultiFilterProxyModel(QSortFilterProxyModel):
 
         results = []
         for key, regex in self.filters.items():
-            text = ''
-            index = self.sourceModel().index(source_row, key, source_parent)
-            if index.isValid():
-                text = self.sourceModel().data(index, Qt.ItemDataRole.DisplayRole)
-                if text is None:
-                    text = ''
-            results.append(regex.match(text))
+            if isinstance(regex, str):
+                matches = self._column_matches(key)
+                results.append(matches is None or source_row in matches)
+            else:
+                text = self._text(source_row, key, source_parent)
+                results.append(regex.match(text))
 
         if self.multi_filter_mode == MultiFilterMode.OR:
             return any(results)
@@ -0,0 +1,50 @@
+from typing import Dict, Iterable, List, Optional, Set
+
+
+class NGramIndex:
+    # Casefolded n-gram index answering substring queries over a list of names.
+    # Candidates are the rows containing every n-gram of the query, which are then
+    # checked with a plain substring test.
+
+    N = 3
+
+    def __init__(self, texts: Iterable[str]):
+        self._texts: List[str] = [t.casefold() for t in texts]
+        self._grams: Dict[str, List[int]] = {}
+        for row, text in enumerate(self._texts):
+            for gram in self._ngrams(text):
+                self._grams.setdefault(gram, []).append(row)
+
+    def __len__(self):
+        return len(self._texts)
+
+    @classmethod
+    def _ngrams(cls, text: str) -> Set[str]:
+        return set(text[i : i + cls.N] for i in range(len(text) - cls.N + 1))
+
+    def search(self, text: str, rows: Optional[Set[int]] = None) -> Set[int]:
+        # rows: known superset of the result, e.g. the matches of a shorter query
+        text = text.casefold()
+        if len(text) < self.N:
+            candidates = rows if rows is not None else range(len(self._texts))
+            return set(r for r in candidates if text in self._texts[r])
+
+        postings = []
+        for gram in self._ngrams(text):
+            found = self._grams.get(gram)
+            if found is None:
+                return set()
+            postings.append(found)
+
+        # Start with the rarest n-gram to keep the intermediate sets small
+        postings.sort(key=len)
+        if rows is not None and len(rows) <= len(postings[0]):
+            candidates = rows
+        else:
+            candidates = set(postings[0])
+            for found in postings[1:]:
+                candidates.intersection_update(found)
+                if len(candidates) == 0:
+                    return candidates
+
+        return set(r for r in candidates if text in self._texts[r])
@@ -0,0 +1,157 @@
+import mmap
+import os
+import struct
+from concurrent.futures import Executor, ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Reads the TES4 header record at the start of .esp / .esm / .esl files, without MO2.
+
+RECORD_HEADER = struct.Struct("<4sIII")
+SUBRECORD_HEADER = struct.Struct("<4sH")
+# Oblivion records have a 20 byte header, records of later games 24 bytes
+RECORD_HEADER_SIZES = (24, 20)
+
+FLAG_MASTER = 0x1
+FLAG_LOCALIZED = 0x80
+FLAG_LIGHT = 0x200
+
+# Files per task handed to a worker thread
+CHUNK_SIZE = 64
+
+
+class PluginHeaderError(Exception):
+    def __init__(self, path, reason: str):
+        super().__init__(f"{path}: {reason}")
+        self.path = str(path)
+        self.reason = reason
+
+
+class PluginHeader:
+    def __init__(self, masters: Sequence[str], flags: int):
+        self.masters = tuple(masters)
+        self.flags = flags
+
+    @property
+    def is_master(self) -> bool:
+        return bool(self.flags & FLAG_MASTER)
+
+    @property
+    def is_light(self) -> bool:
+        return bool(self.flags & FLAG_LIGHT)
+
+    @property
+    def is_localized(self) -> bool:
+        return bool(self.flags & FLAG_LOCALIZED)
+
+
+def parse_plugin_header(data, path="<plugin>") -> PluginHeader:
+    # data: bytes starting with the TES4 record
+    if len(data) < RECORD_HEADER_SIZES[0]:
+        raise PluginHeaderError(path, "file too small")
+    record_type, data_size, flags, _ = RECORD_HEADER.unpack_from(data, 0)
+    if record_type != b"TES4":
+        raise PluginHeaderError(path, "no TES4 header record")
+
+    for header_size in RECORD_HEADER_SIZES:
+        if data[header_size : header_size + 4] == b"HEDR":
+            break
+    else:
+        raise PluginHeaderError(path, "no HEDR subrecord")
+
+    end = header_size + data_size
+    if end > len(data):
+        raise PluginHeaderError(path, "truncated header record")
+
+    masters: List[str] = []
+    offset = header_size
+    next_size = None
+    while offset + SUBRECORD_HEADER.size <= end:
+        subrecord_type, size = SUBRECORD_HEADER.unpack_from(data, offset)
+        offset += SUBRECORD_HEADER.size
+        # XXXX holds the size of the next subrecord if it does not fit 16 bit
+        if next_size is not None:
+            size, next_size = next_size, None
+        if offset + size > end:
+            raise PluginHeaderError(path, "truncated subrecord")
+        if subrecord_type == b"XXXX":
+            next_size = struct.unpack_from("<I", data, offset)[0]
+        elif subrecord_type == b"MAST":
+            name = bytes(data[offset : offset + size]).split(b"\0", 1)[0]
+            masters.append(name.decode("cp1252", errors="replace"))
+        offset += size
+
+    return PluginHeader(masters, flags)
+
+
+def read_plugin_header(path) -> PluginHeader:
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < RECORD_HEADER_SIZES[0]:
+            raise PluginHeaderError(path, "file too small")
+        # Only the pages of the header record are ever read from the mapping
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            data_size = RECORD_HEADER.unpack_from(mapped, 0)[1]
+            length = min(size, RECORD_HEADER_SIZES[0] + data_size)
+            return parse_plugin_header(mapped[:length], path)
+
+
+def _read_chunk(
+    paths: Sequence[str],
+) -> List[Tuple[str, Optional[PluginHeader], Optional[str]]]:
+    results = []
+    for path in paths:
+        try:
+            results.append((path, read_plugin_header(path), None))
+        except PluginHeaderError as ex:
+            results.append((path, None, ex.reason))
+        except (OSError, ValueError, struct.error) as ex:
+            results.append((path, None, str(ex)))
+    return results
+
+
+def scan_plugin_headers(
+    paths: Iterable[str],
+    progress: Optional[Callable[[int, int], None]] = None,
+    workers: Optional[int] = None,
+    executor: Optional[Executor] = None,
+) -> Tuple[Dict[str, PluginHeader], Dict[str, str]]:
+    # Headers and read errors by path.
+    # Files are read by a thread pool: opening and reading release the GIL, which
+    # is where the time goes for files that are not cached by the OS. Worker
+    # processes are not an option, inside MO2 sys.executable is ModOrganizer.exe.
+    # An exception raised by progress stops the scan.
+    paths = list(dict.fromkeys(str(p) for p in paths))
+    headers: Dict[str, PluginHeader] = {}
+    errors: Dict[str, str] = {}
+    chunks = [paths[i : i + CHUNK_SIZE] for i in range(0, len(paths), CHUNK_SIZE)]
+
+    def collect(results):
+        for path, header, error in results:
+            if header is not None:
+                headers[path] = header
+            else:
+                errors[path] = error
+        if progress is not None:
+            progress(len(headers) + len(errors), len(paths))
+
+    if len(chunks) <= 1 and executor is None:
+        for chunk in chunks:
+            collect(_read_chunk(chunk))
+        return headers, errors
+
+    owned = executor is None
+    if owned:
+        executor = ThreadPoolExecutor(workers)
+    try:
+        futures = [executor.submit(_read_chunk, chunk) for chunk in chunks]
+        try:
+            for future in as_completed(futures):
+                collect(future.result())
+        finally:
+            for future in futures:
+                future.cancel()
+    finally:
+        if owned:
+            executor.shutdown()
+
+    return headers, errors
@@ -0,0 +1,78 @@
+import json
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+
+# Plugin lists as written by MO2 (plugins.txt, loadorder.txt), plain lists with one
+# plugin per line, zMerge merge definitions (merges.json) and groups of plugins
+
+
+def parse_plugin_lines(
+    lines: Iterable[str], active_only: Optional[bool] = None
+) -> Iterator[str]:
+    # Comments start with "#". In plugins.txt active plugins are prefixed with "*",
+    # the other lines are inactive plugins and skipped.
+    # active_only: None if lists with a "*" line are plugins.txt
+    names = [line.strip() for line in lines]
+    names = [n for n in names if len(n) > 0 and not n.startswith("#")]
+    if active_only is None:
+        active_only = any(n.startswith("*") for n in names)
+    for name in names:
+        if name.startswith("*"):
+            name = name[1:].lstrip()
+        elif active_only:
+            continue
+        if len(name) > 0:
+            yield name
+
+
+def read_plugin_list(path: Path) -> Iterator[str]:
+    active_only = True if Path(path).name.lower() == "plugins.txt" else None
+    with open(path, "r", encoding="utf-8-sig", errors="replace") as f:
+        yield from parse_plugin_lines(f, active_only)
+
+
+def _plugin_names(plugins, group: str) -> List[str]:
+    # A list of plugin names, or of zMerge plugin entries ({"filename": ...})
+    if not isinstance(plugins, list):
+        raise ValueError(f"The plugins of '{group}' are not a list")
+    names = []
+    for p in plugins:
+        if isinstance(p, dict) and isinstance(p.get("filename"), str):
+            names.append(p["filename"])
+        elif isinstance(p, str):
+            names.append(p)
+        else:
+            raise ValueError(f"'{group}' contains an invalid plugin entry: {p!r}")
+    return names
+
+
+def _zmerge_merges(data) -> Dict[str, List[str]]:
+    # merges.json: [{"name": ..., "plugins": [{"filename": ...}, ...]}, ...]
+    if not isinstance(data, list):
+        raise ValueError("Not a list of merges")
+    merges = {}
+    for merge in data:
+        if not isinstance(merge, dict):
+            raise ValueError(f"Invalid merge entry: {merge!r}")
+        name = str(merge.get("name", f"Merge {len(merges) + 1}"))
+        merges[name] = _plugin_names(merge.get("plugins", []), name)
+    return merges
+
+
+def is_zmerge_file(path: Path) -> bool:
+    return Path(path).suffix.lower() == ".json"
+
+
+def parse_plugin_groups(text: str) -> Dict[str, List[str]]:
+    # zMerge merges.json, or a JSON object with a list of plugins per group name
+    data = json.loads(text)
+    if isinstance(data, dict):
+        return dict(
+            (str(name), _plugin_names(plugins, str(name)))
+            for name, plugins in data.items()
+        )
+    return _zmerge_merges(data)
+
+
+def read_plugin_groups(path: Path) -> Dict[str, List[str]]:
+    return parse_plugin_groups(Path(path).read_text(encoding="utf-8-sig"))
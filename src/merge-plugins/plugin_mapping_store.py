@@ -0,0 +1,277 @@
+from array import array
+from typing import Dict, Iterable, Iterator, Mapping, Optional, Sequence, Tuple
+
+
+class PluginMappingStore(Sequence):
+    # Plugin mapping stored in columns (plugin priority, plugin name id, mod priority,
+    # mod name id). Plugin and mod names are interned in one string table, so every
+    # mod name exists once no matter how many plugins it contains.
+    # Rows are read as (priority, plugin, priority_mod, mod) tuples.
+    #
+    # Plugins and mods are looked up case-insensitively through two permutations of
+    # the rows, sorted by casefolded plugin name and by casefolded mod name. They are
+    # stored with the mapping, so a loaded mapping needs no rebuild.
+
+    __slots__ = (
+        "_plugin_priorities",
+        "_plugin_names",
+        "_mod_priorities",
+        "_mod_names",
+        "_strings",
+        "_string_ids",
+        "_priority_rows",
+        "_plugin_order",
+        "_mod_order",
+        "_unmanaged_count",
+        "_found_plugins",
+        "_found_mods",
+    )
+
+    def __init__(self, rows: Iterable[Tuple[int, str, int, str]] = ()):
+        self._plugin_priorities = array("i")
+        self._plugin_names = array("I")
+        self._mod_priorities = array("i")
+        self._mod_names = array("I")
+        self._strings: Sequence[str] = []
+        self._string_ids: Optional[Dict[str, int]] = {}
+        self._priority_rows: Optional[Dict[int, int]] = None
+        self._plugin_order: Optional[Sequence[int]] = None
+        self._mod_order: Optional[Sequence[int]] = None
+        self._unmanaged_count: Optional[int] = None
+        # Results of previous lookups, only filled for names that were looked up
+        self._found_plugins: Dict[str, int] = {}
+        self._found_mods: Dict[str, Sequence[int]] = {}
+        for priority, plugin, priority_mod, mod in rows:
+            self.append(priority, plugin, priority_mod, mod)
+
+    @classmethod
+    def from_columns(
+        cls,
+        strings: Sequence[str],
+        plugin_priorities: Sequence[int],
+        plugin_names: Sequence[int],
+        mod_priorities: Sequence[int],
+        mod_names: Sequence[int],
+        plugin_order: Optional[Sequence[int]] = None,
+        mod_order: Optional[Sequence[int]] = None,
+    ) -> "PluginMappingStore":
+        # Columns may be views of a memory-mapped file, see detach()
+        store = cls()
+        if plugin_order is not None and len(plugin_order) == len(plugin_priorities):
+            store._plugin_order = plugin_order
+        if mod_order is not None and len(mod_order) == len(plugin_priorities):
+            store._mod_order = mod_order
+        store._strings = strings
+        store._string_ids = None
+        store._plugin_priorities = plugin_priorities
+        store._plugin_names = plugin_names
+        store._mod_priorities = mod_priorities
+        store._mod_names = mod_names
+        return store
+
+    def _intern(self, s: str) -> int:
+        if self._string_ids is None:
+            # Strings of a loaded file are decoded on demand, appending needs all
+            self._strings = [self._strings[i] for i in range(len(self._strings))]
+            self._string_ids = dict((s, i) for i, s in enumerate(self._strings))
+        string_id = self._string_ids.get(s)
+        if string_id is None:
+            string_id = len(self._strings)
+            self._string_ids[s] = string_id
+            self._strings.append(s)
+        return string_id
+
+    def append(self, priority: int, plugin: str, priority_mod: int, mod: str):
+        if not isinstance(self._plugin_priorities, array):
+            self.detach()
+        row = len(self)
+        self._plugin_priorities.append(priority)
+        self._plugin_names.append(self._intern(plugin))
+        self._mod_priorities.append(priority_mod)
+        self._mod_names.append(self._intern(mod))
+        self._priority_rows = None
+        self._unmanaged_count = None
+        self._found_plugins.clear()
+        self._found_mods.clear()
+
+        # Existing indexes are updated, missing ones are built on first use
+        if self._plugin_order is not None:
+            order = self._plugin_order
+            i = self._bisect(order, self._plugin_names, plugin.casefold())
+            order.insert(i, row)
+        if self._mod_order is not None:
+            order = self._mod_order
+            i = self._bisect(order, self._mod_names, mod.casefold(), True)
+            order.insert(i, row)
+
+    def __len__(self):
+        return len(self._plugin_priorities)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return (
+            self._plugin_priorities[i],
+            self._strings[self._plugin_names[i]],
+            self._mod_priorities[i],
+            self._strings[self._mod_names[i]],
+        )
+
+    def __iter__(self) -> Iterator[Tuple[int, str, int, str]]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def plugin_priority(self, row: int) -> int:
+        return self._plugin_priorities[row]
+
+    def plugin(self, row: int) -> str:
+        return self._strings[self._plugin_names[row]]
+
+    def mod_priority(self, row: int) -> int:
+        return self._mod_priorities[row]
+
+    def mod(self, row: int) -> str:
+        return self._strings[self._mod_names[row]]
+
+    def cell(self, row: int, column: int):
+        if column == 0:
+            return self._plugin_priorities[row]
+        if column == 1:
+            return self._strings[self._plugin_names[row]]
+        if column == 2:
+            return self._mod_priorities[row]
+        return self._strings[self._mod_names[row]]
+
+    def row_of_priority(self, priority: int) -> int:
+        if self._priority_rows is None:
+            self._priority_rows = dict(
+                (p, row) for row, p in enumerate(self._plugin_priorities)
+            )
+        return self._priority_rows.get(priority, -1)
+
+    def _plugin_key(self, row: int) -> str:
+        return self._strings[self._plugin_names[row]].casefold()
+
+    def _mod_key(self, row: int) -> str:
+        return self._strings[self._mod_names[row]].casefold()
+
+    def _bisect(
+        self, order: Sequence[int], names: Sequence[int], value: str, right=False
+    ) -> int:
+        # names: name id column the order is sorted by
+        strings = self._strings
+        lo, hi = 0, len(order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            k = strings[names[order[mid]]].casefold()
+            if k < value or (right and k == value):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _sorted_rows(self, key) -> Sequence[int]:
+        return array("I", sorted(range(len(self)), key=key))
+
+    @property
+    def plugin_order(self) -> Sequence[int]:
+        # Rows sorted by casefolded plugin name
+        if self._plugin_order is None:
+            self._plugin_order = self._sorted_rows(self._plugin_key)
+        return self._plugin_order
+
+    @property
+    def mod_order(self) -> Sequence[int]:
+        # Rows sorted by casefolded mod name, rows of a mod in mapping order
+        if self._mod_order is None:
+            self._mod_order = self._sorted_rows(self._mod_key)
+        return self._mod_order
+
+    def build_indexes(self):
+        # Builds the plugin and mod order now instead of on the first lookup
+        if self._plugin_order is None:
+            self._plugin_order = self._sorted_rows(self._plugin_key)
+        if self._mod_order is None:
+            self._mod_order = self._sorted_rows(self._mod_key)
+
+    def row_of_plugin(self, plugin: str) -> int:
+        key = plugin.casefold()
+        row = self._found_plugins.get(key)
+        if row is None:
+            order = self.plugin_order
+            i = self._bisect(order, self._plugin_names, key)
+            if i < len(order) and self._plugin_key(order[i]) == key:
+                row = order[i]
+            else:
+                row = -1
+            self._found_plugins[key] = row
+        return row
+
+    def rows_of_mod(self, mod: str) -> Sequence[int]:
+        key = mod.casefold()
+        rows = self._found_mods.get(key)
+        if rows is None:
+            order = self.mod_order
+            start = self._bisect(order, self._mod_names, key)
+            end = self._bisect(order, self._mod_names, key, True)
+            # A copy, slices of a loaded order are views of the memory-mapped file
+            rows = self._found_mods[key] = array("I", order[start:end])
+        return rows
+
+    @property
+    def plugin_to_mod(self) -> Mapping[str, str]:
+        return _PluginToMod(self)
+
+    def managed_plugin_count(self, mod: str) -> int:
+        # Plugins of a mod of the mod list, 0 for plugins outside of it (game data)
+        rows = self.rows_of_mod(mod)
+        if len(rows) == 0 or self._mod_priorities[rows[0]] < 0:
+            return 0
+        return len(rows)
+
+    def unmanaged_plugin_count(self) -> int:
+        if self._unmanaged_count is None:
+            self._unmanaged_count = sum(1 for p in self._mod_priorities if p < 0)
+        return self._unmanaged_count
+
+    def detach(self):
+        # Copy the columns out of a memory-mapped file so it can be closed
+        if hasattr(self._strings, "detach"):
+            self._strings.detach()
+        self._plugin_priorities = array("i", self._plugin_priorities)
+        self._plugin_names = array("I", self._plugin_names)
+        self._mod_priorities = array("i", self._mod_priorities)
+        self._mod_names = array("I", self._mod_names)
+        if self._plugin_order is not None:
+            self._plugin_order = array("I", self._plugin_order)
+        if self._mod_order is not None:
+            self._mod_order = array("I", self._mod_order)
+        self._found_plugins.clear()
+        self._found_mods.clear()
+
+
+class _PluginToMod(Mapping):
+    # Case-insensitive plugin -> mod view of a store
+
+    def __init__(self, store: PluginMappingStore):
+        self._store = store
+
+    def __getitem__(self, plugin: str) -> str:
+        row = self._store.row_of_plugin(plugin)
+        if row < 0:
+            raise KeyError(plugin)
+        return self._store.mod(row)
+
+    def __contains__(self, plugin) -> bool:
+        return isinstance(plugin, str) and self._store.row_of_plugin(plugin) >= 0
+
+    def __len__(self):
+        return len(self._store)
+
+    def __iter__(self) -> Iterator[str]:
+        for row in range(len(self._store)):
+            yield self._store.plugin(row)
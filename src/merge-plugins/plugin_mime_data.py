@@ -0,0 +1,44 @@
+import json
+from typing import Any, List, Optional, Tuple
+
+try:
+    import PyQt6.QtCore as QtCore
+except ImportError:
+    import PyQt5.QtCore as QtCore
+
+from .plugin_mapping_store import PluginMappingStore
+
+
+class PluginMimeData(QtCore.QMimeData):
+    # Drag payload referencing the dragged rows of the shared plugin mapping store.
+    # Drops inside the dialog use the rows directly, JSON is only encoded when
+    # another application asks for it.
+
+    def __init__(
+        self,
+        source: QtCore.QAbstractItemModel,
+        mime_type: str,
+        store: PluginMappingStore,
+        rows: List[int],
+        row_ids: Optional[List[int]] = None,
+    ):
+        super().__init__()
+        self.source = source
+        self.store = store
+        # Rows of the store
+        self.rows = rows
+        # Stable ids of the rows in the source model
+        self.row_ids = row_ids
+        self._mime_type = mime_type
+
+    @property
+    def entries(self) -> List[Tuple[int, str, int, str]]:
+        return [self.store[r] for r in self.rows]
+
+    def formats(self) -> List[str]:
+        return [self._mime_type]
+
+    def retrieveData(self, mime_type: str, preferred_type) -> Any:
+        if mime_type == self._mime_type:
+            return QtCore.QByteArray(json.dumps(self.entries).encode())
+        return super().retrieveData(mime_type, preferred_type)
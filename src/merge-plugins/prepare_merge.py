@@ -1,15 +1,19 @@
+import time
 from typing import List
 
 import mobase
 
 try:
     import PyQt6.QtGui as QtGui
+    from PyQt6.QtCore import qInfo
     from PyQt6.QtWidgets import QApplication
 except ImportError:
     import PyQt5.QtGui as QtGui
+    from PyQt5.QtCore import qInfo
     from PyQt5.QtWidgets import QApplication
 
-from .prepare_merge_window import PrepareMergeWindow
+from .prepare_merge_settings import PrepareMergeSettings
+from .prepare_merge_window import PrepareMergeWindow, get_settings_path
 
 
 class PrepareMerge(mobase.IPluginTool):
@@ -28,12 +32,45 @@ class PrepareMerge(mobase.IPluginTool):
         self.__parentWidget = None
 
     def init(self, organizer: mobase.IOrganizer):
+        start = time.perf_counter()
         self.__organizer = organizer
-        self.__window = PrepareMergeWindow(self.__organizer)
+        # The window and the mapping are only created when the tool is opened
+        self.__organizer.onProfileChanged(self.__profile_changed)
+        qInfo(f"{self.NAME}: init took {self.__elapsed_ms(start):.1f} ms")
         return True
 
+    @staticmethod
+    def __elapsed_ms(start: float) -> float:
+        return (time.perf_counter() - start) * 1000
+
+    def __get_window(self, settings: PrepareMergeSettings = None):
+        if self.__window is None:
+            start = time.perf_counter()
+            self.__window = PrepareMergeWindow(self.__organizer, settings)
+            qInfo(
+                f"{self.NAME}: window creation took {self.__elapsed_ms(start):.1f} ms"
+            )
+        return self.__window
+
+    def __profile_changed(self, old: mobase.IProfile, _: mobase.IProfile) -> None:
+        if not old:
+            return
+
+        settings = None
+        if self.__window is None:
+            # Only create the window if the mapping of the base profile is affected
+            settings_path = get_settings_path(self.__organizer)
+            settings = PrepareMergeSettings()
+            if not settings_path.exists() or not settings.read_file(settings_path):
+                return
+            if settings.selected_main_profile != old.name():
+                settings.close()
+                return
+
+        self.__get_window(settings).update_mapping(old.name())
+
     def display(self):
-        self.__window.init()
+        self.__get_window().init()
         self.__window.setWindowTitle(f"{self.NAME} v{self.version().displayString()}")
         self.__window.exec()
 
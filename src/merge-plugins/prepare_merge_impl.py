@@ -1,4 +1,5 @@
-from typing import List, Dict, Tuple
+from pathlib import Path
+from typing import Iterable, List, Optional, Sequence, Tuple
 
 import mobase
 
@@ -7,7 +8,12 @@ try:
 except ImportError:
     from PyQt5.QtCore import qInfo
 
-PluginMapping = List[Tuple[int, str, int, str]]
+from .instrumentation import InstrumentedOrganizer, MergeReport
+from .mapping_builder import MappingSnapshot, mapping_fingerprint
+from .master_graph import MasterGraph
+from .merge_planner import MergePlan
+
+PluginMapping = Sequence[Tuple[int, str, int, str]]
 
 
 class PrepareMergeException(Exception):
@@ -15,112 +21,285 @@ class PrepareMergeException(Exception):
         self.plugin = plugin
 
 
-def create_plugin_mapping_impl(organizer: mobase.IOrganizer) -> PluginMapping:
+def snapshot_plugin_mapping_impl(
+    organizer: mobase.IOrganizer,
+    mapping: Optional[PluginMapping] = None,
+    with_masters: bool = False,
+    active_mods: Optional[List[str]] = None,
+) -> MappingSnapshot:
+    # Reads everything needed to build the mapping of the current profile, the
+    # mapping itself is built by mapping_builder without touching MO2.
+    # Origins (and masters) are only queried for plugins that are not in the
+    # previous mapping or may have changed.
+    # active_mods: active mods by priority when the previous mapping was built
     pluginlist = organizer.pluginList()
     modlist = organizer.modList()
 
-    data: PluginMapping = []
+    profile = organizer.profile()
+    snapshot = MappingSnapshot(profile.name(), Path(profile.absolutePath()))
+    if mapping is not None:
+        snapshot.previous = dict((entry[1], entry) for entry in mapping)
+    snapshot.mods_by_priority = modlist.allModsByProfilePriority()
+    snapshot.active_mods = [
+        m
+        for m in snapshot.mods_by_priority
+        if modlist.state(m) & mobase.ModState.ACTIVE
+    ]
+
+    # Each mod is queried once instead of once per plugin it contains
+    mod_priorities = snapshot.mod_priorities
+
+    def mod_priority(mod: str) -> int:
+        if mod not in mod_priorities:
+            mod_priorities[mod] = modlist.priority(mod)
+        return mod_priorities[mod]
+
+    # A mod that was added or enabled may override plugins of any other mod, then
+    # all origins are queried again. Unknown active mods are handled the same.
+    query_all = active_mods is None or not set(snapshot.active_mods).issubset(
+        active_mods
+    )
+
+    # Plugins of mods that were moved, removed or disabled may have a new origin
+    moved_mods = set()
+    if active_mods is not None:
+        moved_mods.update(set(active_mods).difference(snapshot.active_mods))
+    for _, _, priority_mod, mod in snapshot.previous.values():
+        if mod not in mod_priorities and mod_priority(mod) != priority_mod:
+            moved_mods.add(mod)
 
     for plugin in pluginlist.pluginNames():
-        mod = pluginlist.origin(plugin)
         priority = pluginlist.priority(plugin)
-        priority_mod = modlist.priority(mod)
-        data.append((priority, plugin, priority_mod, mod))
+        snapshot.plugins.append((plugin, priority))
+
+        entry = snapshot.previous.get(plugin)
+        if (
+            not query_all
+            and entry is not None
+            and entry[0] == priority
+            and entry[3] not in moved_mods
+        ):
+            continue
+
+        mod = pluginlist.origin(plugin)
+        snapshot.origins[plugin] = mod
+        # Masters are only read again if the entry changed
+        if (priority, plugin, mod_priority(mod), mod) == entry:
+            continue
+        if with_masters:
+            # Headers of plugins on disk are read by the builder, off the GUI thread
+            path = organizer.resolvePath(plugin)
+            if path:
+                snapshot.plugin_paths[plugin] = path
+            else:
+                snapshot.masters[plugin] = pluginlist.masters(plugin)
+                if pluginlist.isMaster(plugin):
+                    snapshot.master_flags.add(plugin)
+
+    return snapshot
 
-    return data
+
+def plugin_mapping_fingerprint_impl(organizer: mobase.IOrganizer) -> str:
+    return mapping_fingerprint(
+        organizer.pluginList().pluginNames(),
+        organizer.modList().allModsByProfilePriority(),
+        Path(organizer.profile().absolutePath()),
+    )
+
+
+def apply_plugin_states_impl(
+    organizer: mobase.IOrganizer, plugins_to_enable: Iterable[str]
+) -> Tuple[int, List[str]]:
+    pluginlist = organizer.pluginList()
+
+    to_enable = set(MasterGraph.key(p) for p in plugins_to_enable)
+
+    # Read every state once and only issue the transitions that are needed
+    state_changes = 0
+    disabled = []
+    for p in pluginlist.pluginNames():
+        active = pluginlist.state(p) == mobase.PluginState.ACTIVE
+        if MasterGraph.key(p) in to_enable:
+            if not active:
+                pluginlist.setState(p, mobase.PluginState.ACTIVE)
+                state_changes += 1
+        elif active:
+            pluginlist.setState(p, mobase.PluginState.INACTIVE)
+            state_changes += 1
+            disabled.append(p)
+
+    # Mandatory plugins of the game stay active
+    mandatory_plugins = [
+        p for p in disabled if pluginlist.state(p) == mobase.PluginState.ACTIVE
+    ]
+
+    return state_changes, mandatory_plugins
 
 
 def activate_plugins_impl(
-    organizer: mobase.IOrganizer, plugins: List[str], plugin_to_mod: Dict[str, str]
+    organizer: mobase.IOrganizer,
+    plan: MergePlan,
+    report: Optional[MergeReport] = None,
 ):
+    # report: receives the time and the MO2 calls of every phase
+    if report is None:
+        report = MergeReport()
+    organizer = InstrumentedOrganizer(organizer, report)
     modlist = organizer.modList()
     pluginlist = organizer.pluginList()
 
+    plugins = plan.plugins
+    plugin_to_mod = plan.plugin_to_mod
+
+    # Fail before anything is changed
+    if len(plan.missing) > 0:
+        raise PrepareMergeException(plan.missing[0])
+
     # Disable all mods
-    modlist.setActive(modlist.allMods(), active=False)
+    with report.phase("disable mods"):
+        modlist.setActive(modlist.allMods(), active=False)
 
     enabled_plugins = set()
-    enabled_mods = set()
+    enabled_mods = set(plan.mods)
 
-    try:
+    # Enable no plugins (except mandatory)
+    # Without any active mod this only touches the plugins of the game itself
+    with report.phase("disable plugins"):
+        state_changes, mandatory_plugins = apply_plugin_states_impl(organizer, [])
 
-        mods = [plugin_to_mod[p] for p in plugins]
-        # Enable mods with selected plugins
-        modlist.setActive(mods, active=True)
-        enabled_mods.update(mods)
+    # Enable mods with selected plugins
+    with report.phase("enable mods"):
+        modlist.setActive(plan.plugin_mods, active=True)
 
         qInfo(
-            f"Enabling {mods} containing the selected plugins {plugins}".encode(
+            f"Enabling {plan.plugin_mods} containing the selected plugins {plugins}".encode(
                 'ascii', 'replace').decode('ascii')
         )
 
-        # Enable only selected plugins
-        def enable_plugins(plugins_to_enable):
-            for p in pluginlist.pluginNames():
-                if p in plugins_to_enable:
-                    pluginlist.setState(p, mobase.PluginState.ACTIVE)
-                else:
-                    pluginlist.setState(p, mobase.PluginState.INACTIVE)
-
-        # Enable no plugins (except mandatory)
-        enable_plugins([])
-        mandatory_plugins = [
-            p
-            for p in pluginlist.pluginNames()
-            if pluginlist.state(p) == mobase.PluginState.ACTIVE
-        ]
+        if len(plan.master_mods) > 0:
+            qInfo(
+                f"Enabling {plan.master_mods} containing the masters of {plugins}".encode(
+                    'ascii', 'replace').decode('ascii')
+            )
+            # Doing this in one call like this: modlist.setActive(plan.master_mods, active=True)
+            # results in MO2 showing a "failed to restore load order" error for some mod combinations
+            # Probably a bug on MO2
+            for mod in plan.master_mods:
+                modlist.setActive(mod, active=True)
 
-        # Enable missing masters
-        plugins_and_masters = set(mandatory_plugins)
-        plugins_and_masters_to_check = set(plugins)
+    plugins_and_masters = set(mandatory_plugins)
+    plugins_and_masters.update(plan.plugins_to_activate)
 
-        # Checking masters of plugins (and their masters, and so on)
+    try:
+        # Enable missing masters
+        # Checking masters of plugins unknown to the master graph (and their masters,
+        # and so on)
+        plugins_and_masters_to_check = set(plan.unresolved)
+        rounds = 0
         while len(plugins_and_masters_to_check) > 0:
-            plugins_and_masters.update(plugins_and_masters_to_check)
+            rounds += 1
+            with report.phase(f"master round {rounds}"):
+                plugins_and_masters.update(plugins_and_masters_to_check)
 
-            # Extract all masters of plugins in the current loop
-            for p in plugins_and_masters_to_check.copy():
-                masters = pluginlist.masters(p)
-                plugins_and_masters_to_check.update(masters)
+                # Extract all masters of plugins in the current loop
+                for p in plugins_and_masters_to_check.copy():
+                    masters = pluginlist.masters(p)
+                    plugins_and_masters_to_check.update(masters)
 
-            # Remove all masters that were already checked in a previous loop
-            plugins_and_masters_to_check.difference_update(plugins_and_masters)
+                # Remove all masters that were already checked in a previous loop
+                plugins_and_masters_to_check.difference_update(plugins_and_masters)
 
-            # Missing masters found -> enable mods and do another round checking them for masters
-            if len(plugins_and_masters_to_check) > 0:
-                additional_mods = set(
-                    [plugin_to_mod[p] for p in plugins_and_masters_to_check]
-                )
-                qInfo(
-                    f"Enabling {additional_mods} containing missing masters {plugins_and_masters_to_check}".encode(
-                        'ascii', 'replace').decode('ascii')
-                )
-                # Doing this in one call like this: modlist.setActive(list(additional_mods), active=True)
-                # results in MO2 showing a "failed to restore load order" error for some mod combinations
-                # Probably a bug on MO2
-                for mod in additional_mods:
-                    modlist.setActive(mod, active=True)
+                # Missing masters found -> enable mods and do another round checking them for masters
+                if len(plugins_and_masters_to_check) > 0:
+                    additional_mods = set(
+                        [plugin_to_mod[p] for p in plugins_and_masters_to_check]
+                    )
+                    qInfo(
+                        f"Enabling {additional_mods} containing missing masters {plugins_and_masters_to_check}".encode(
+                            'ascii', 'replace').decode('ascii')
+                    )
+                    # Enabled one by one for the same reason as above
+                    for mod in additional_mods:
+                        modlist.setActive(mod, active=True)
 
-                enabled_mods.update(additional_mods)
+                    enabled_mods.update(additional_mods)
 
     except KeyError as e:
         raise PrepareMergeException(e.args[0])
 
     # Enable only target plugins and their masters
     # Not other plugins inside the same mod
-    enable_plugins(plugins_and_masters)
+    with report.phase("enable plugins"):
+        state_changes += apply_plugin_states_impl(organizer, plugins_and_masters)[0]
+    qInfo(f"Issued {state_changes} plugin state changes")
 
     enabled_plugins.update(plugins_and_masters)
     enabled_plugins.difference_update(mandatory_plugins)
 
-    # Place plugins at end of load order
-    max_priority = len(pluginlist.pluginNames()) - 1
-    for idx, p in enumerate(reversed(plugins)):
-        pluginlist.setPriority(p, max_priority - idx)
+    if len(plan.conflicts) > 0:
+        qInfo(
+            f"Plugins that cannot be placed as requested {plan.conflicts}".encode(
+                'ascii', 'replace').decode('ascii')
+        )
 
-    order_correct = True
-    for idx, p in enumerate(reversed(plugins)):
-        if pluginlist.priority(p) != max_priority - idx:
-            order_correct = False
+    with report.phase("place plugins"):
+        moves, placed = place_plugins_impl(organizer, plan.load_order)
+    order_correct = len(plan.conflicts) == 0 and placed
+
+    report.info.update(
+        {
+            "selected_plugins": len(plugins),
+            "enabled_plugins": len(enabled_plugins),
+            "enabled_mods": len(enabled_mods),
+            "master_rounds": rounds,
+            "state_changes": state_changes,
+            "moved_plugins": moves,
+            "conflicts": len(plan.conflicts),
+            "order_correct": order_correct,
+        }
+    )
 
     return list(enabled_plugins), list(enabled_mods), order_correct
+
+
+def place_plugins_impl(
+    organizer: mobase.IOrganizer, plugins: List[str]
+) -> Tuple[int, bool]:
+    # Moves the plugins to the end of the load order with as few priority changes
+    # as possible. Positions are tracked locally while moving, MO2 may refuse or
+    # adjust a move though (e.g. masters stay in front of regular plugins), so the
+    # result is read back. Returns the number of moves and if all plugins are placed.
+    pluginlist = organizer.pluginList()
+
+    first_priority = len(pluginlist.pluginNames()) - len(plugins)
+    positions = [pluginlist.priority(p) for p in plugins]
+
+    # Plugins already in place at the very end stay there
+    placed = len(plugins)
+    while placed > 0 and positions[placed - 1] == first_priority + placed - 1:
+        placed -= 1
+
+    moves = 0
+    # Placing from the back only shifts plugins that are not placed yet
+    for idx in reversed(range(placed)):
+        current = positions[idx]
+        target = first_priority + idx
+        if current == target:
+            continue
+        if not pluginlist.setPriority(plugins[idx], target):
+            qInfo(
+                f"Could not move {plugins[idx]}".encode("ascii", "replace").decode(
+                    "ascii"
+                )
+            )
+            continue
+        moves += 1
+        for j in range(idx):
+            if current < positions[j] <= target:
+                positions[j] -= 1
+
+    in_place = all(
+        pluginlist.priority(p) == first_priority + idx for idx, p in enumerate(plugins)
+    )
+    qInfo(f"Moved {moves} of {len(plugins)} plugins")
+    return moves, in_place
@@ -1,6 +1,6 @@
 import json
 import typing
-from typing import List, Tuple
+from typing import Iterable, List
 
 try:
     import PyQt6.QtCore as QtCore
@@ -11,13 +11,31 @@ except ImportError:
     from PyQt5.QtCore import Qt, QModelIndex
     from PyQt5.QtWidgets import QApplication
 
+from .plugin_mapping_store import PluginMappingStore
+from .plugin_mime_data import PluginMimeData
+
 
 class PrepareMergeListModel(QtCore.QAbstractTableModel):
-    _data: List[Tuple[int, str, int, str]] = []
     _header = ("", "Selected Plugins", "", "")
 
-    def init_data(self, data):
-        self._data = data
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._store = PluginMappingStore()
+        # Store row of every selected plugin
+        self._data: List[int] = []
+        # Stable id of every row, kept while rows are moved around
+        self._ids: List[int] = []
+        self._next_id = 0
+
+    def _new_ids(self, count: int) -> List[int]:
+        ids = list(range(self._next_id, self._next_id + count))
+        self._next_id += count
+        return ids
+
+    def init_data(self, store: PluginMappingStore, rows: Iterable[int] = ()):
+        self._store = store
+        self._data = list(rows)
+        self._ids = self._new_ids(len(self._data))
         self.layoutChanged.emit()
 
     def __tr(self, name: str):
@@ -31,17 +49,79 @@ class PrepareMergeListModel(QtCore.QAbstractTableModel):
 
     def data(self, index: QModelIndex, role: int = ...) -> typing.Any:
         if role == Qt.ItemDataRole.DisplayRole:
-            return self._data[index.row()][index.column()]
+            return self._store.cell(self._data[index.row()], index.column())
         elif role == Qt.ItemDataRole.ToolTipRole:
-            return f"{self._data[index.row()][3]}"
+            return self._store.mod(self._data[index.row()])
 
     def removeRows(self, row: int, count: int, parent: QModelIndex = ...) -> bool:
+        if count <= 0 or row < 0 or row + count > len(self._data):
+            return False
         self.beginRemoveRows(QModelIndex(), row, row + count - 1)
-        for _ in range(count):
-            del self._data[row]
+        del self._data[row : row + count]
+        del self._ids[row : row + count]
         self.endRemoveRows()
         return True
 
+    def moveRows(
+        self,
+        sourceParent: QModelIndex,
+        sourceRow: int,
+        count: int,
+        destinationParent: QModelIndex,
+        destinationChild: int,
+    ) -> bool:
+        if count <= 0 or sourceRow < 0 or sourceRow + count > len(self._data):
+            return False
+        if destinationChild < 0 or destinationChild > len(self._data):
+            return False
+        # Fails for moves onto the rows themselves
+        if not self.beginMoveRows(
+            QModelIndex(),
+            sourceRow,
+            sourceRow + count - 1,
+            QModelIndex(),
+            destinationChild,
+        ):
+            return False
+        if destinationChild > sourceRow:
+            destinationChild -= count
+        for store in (self._data, self._ids):
+            moved = store[sourceRow : sourceRow + count]
+            del store[sourceRow : sourceRow + count]
+            store[destinationChild:destinationChild] = moved
+        self.endMoveRows()
+        return True
+
+    def moveEntries(self, row_ids: List[int], destination: int):
+        # Moves the rows, keeping their order, in front of the destination row
+        moved_ids = set(row_ids)
+        destination = max(destination, 0)
+
+        # Contiguous runs of rows (start, count) and the first row staying in place
+        # at or after the destination, from a single pass over the rows
+        runs: List[List[int]] = []
+        anchor = len(self._ids)
+        for row, row_id in enumerate(self._ids):
+            if row_id not in moved_ids:
+                if row >= destination and anchor == len(self._ids):
+                    anchor = row
+            elif len(runs) > 0 and sum(runs[-1]) == row:
+                runs[-1][1] += 1
+            else:
+                runs.append([row, 1])
+
+        # Each run is moved with a single moveRows. Runs in front of the anchor leave
+        # it in place and shift the later runs forward, runs behind it push it back.
+        moved_before = moved_after = 0
+        for start, count in runs:
+            if start < anchor:
+                source, target = start - moved_before, anchor
+                moved_before += count
+            else:
+                source, target = start, anchor + moved_after
+                moved_after += count
+            self.moveRows(QModelIndex(), source, count, QModelIndex(), target)
+
     def columnCount(self, parent: QModelIndex = ...) -> int:
         return 4
 
@@ -63,13 +143,14 @@ class PrepareMergeListModel(QtCore.QAbstractTableModel):
             return default_flags | Qt.ItemFlag.ItemIsDropEnabled
 
     def mimeData(self, indexes: typing.Iterable[QModelIndex]) -> QtCore.QMimeData:
-        mime_data = QtCore.QMimeData()
-        data = []
-        for i in indexes:
-            data.append(self._data[i.row()])
-        data_json = json.dumps(data)
-        mime_data.setData("application/json/list", data_json.encode())
-        return mime_data
+        rows = list(dict.fromkeys(i.row() for i in indexes))
+        return PluginMimeData(
+            self,
+            "application/json/list",
+            self._store,
+            [self._data[r] for r in rows],
+            [self._ids[r] for r in rows],
+        )
 
     def mimeTypes(self) -> typing.List[str]:
         return ["application/json/table", "application/json/list"]
@@ -98,22 +179,32 @@ class PrepareMergeListModel(QtCore.QAbstractTableModel):
         else:
             begin_row = len(self._data)
 
-        if data.hasFormat("application/json/list"):
-            data_json = data.data("application/json/list").data().decode()
+        if isinstance(data, PluginMimeData) and data.store is self._store:
+            if data.source is self:
+                self.moveEntries(data.row_ids, begin_row)
+                # Moved in place, nothing for the view to remove afterwards
+                return False
+            rows = data.rows
         else:
-            data_json = data.data("application/json/table").data().decode()
-        new_data = json.loads(data_json)
-
-        if len(new_data) == 0 or len(new_data[0]) != 4:
-            return False
-
-        self.insertEntries(begin_row, new_data)
+            if data.hasFormat("application/json/list"):
+                data_json = data.data("application/json/list").data().decode()
+            else:
+                data_json = data.data("application/json/table").data().decode()
+            new_data = json.loads(data_json)
+            if len(new_data) == 0 or len(new_data[0]) != 4:
+                return False
+            rows = [self._store.row_of_priority(d[0]) for d in new_data]
+            rows = [r for r in rows if r >= 0]
+
+        self.insertEntries(begin_row, rows)
 
         return True
 
-    def insertEntries(self, start, data):
-        self.beginInsertRows(QModelIndex(), start, start + len(data) - 1)
-        for d in data:
-            self._data.insert(start, d)
-            start += 1
+    def insertEntries(self, start: int, rows: List[int]):
+        # rows: rows of the store
+        if len(rows) == 0:
+            return
+        self.beginInsertRows(QModelIndex(), start, start + len(rows) - 1)
+        self._data[start:start] = rows
+        self._ids[start:start] = self._new_ids(len(rows))
         self.endInsertRows()
@@ -0,0 +1,383 @@
+import json
+import mmap
+import struct
+import sys
+from array import array
+from json import JSONDecodeError
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .master_graph import MasterGraph
+from .plugin_mapping_store import PluginMappingStore
+
+# Binary settings file (little endian):
+#   header:   magic, version (major, minor, patch) and number of sections
+#   sections: tag, offset and size of every section
+#   payload:  section data, each section aligned to 4 bytes
+#
+# Strings are stored once in a string table (STRO offsets into the STRS blob) and
+# referenced by id from the mapping columns and the META section.
+# Readers skip sections with unknown tags, so adding a section only bumps the minor
+# version.
+MAGIC = b"PMSB"
+HEADER = struct.Struct("<4s4H")
+SECTION = struct.Struct("<4sII")
+
+STRING_OFFSETS = b"STRO"
+STRINGS = b"STRS"
+META = b"META"
+PLUGIN_PRIORITIES = b"PPRI"
+PLUGIN_NAMES = b"PNAM"
+MOD_PRIORITIES = b"MPRI"
+MOD_NAMES = b"MNAM"
+# Master graph: MASTERS[MASTER_OFFSETS[i] : MASTER_OFFSETS[i + 1]] of mapping row i
+MASTER_OFFSETS = b"MOFF"
+MASTERS = b"MAST"
+# Mapping rows that are not part of the master graph
+UNKNOWN_MASTERS = b"MUNK"
+# Mapping rows with the master flag
+MASTER_FLAGS = b"MFLG"
+# Mapping rows sorted by casefolded plugin name and by casefolded mod name
+PLUGIN_ORDER = b"PORD"
+MOD_ORDER = b"MORD"
+# String ids of the active mods by priority when the mapping was built
+ACTIVE_MODS = b"AMOD"
+
+
+def _to_array(typecode: str, buffer) -> Sequence[int]:
+    if sys.byteorder == "little":
+        return memoryview(buffer).cast(typecode)
+    # Column data is stored little endian -> copy and swap on big endian machines
+    data = array(typecode)
+    data.frombytes(buffer)
+    data.byteswap()
+    return data
+
+
+def _to_bytes(typecode: str, values) -> bytes:
+    data = array(typecode, values)
+    if sys.byteorder != "little":
+        data.byteswap()
+    return data.tobytes()
+
+
+def pack_sections(magic: bytes, version: Tuple[int, int, int], sections) -> bytes:
+    # sections: (tag, data) pairs
+    header = bytearray(
+        HEADER.pack(magic, *version, len(sections))
+        + bytes(SECTION.size * len(sections))
+    )
+    payload = bytearray()
+    for i, (tag, data) in enumerate(sections):
+        payload.extend(bytes(-(len(header) + len(payload)) % 4))
+        SECTION.pack_into(
+            header,
+            HEADER.size + i * SECTION.size,
+            tag,
+            len(header) + len(payload),
+            len(data),
+        )
+        payload.extend(data)
+
+    return bytes(header + payload)
+
+
+def unpack_sections(
+    data, magic: bytes, major: int
+) -> Optional[Dict[bytes, memoryview]]:
+    # Views of the sections by tag, None for files of another format or major version
+    if len(data) < HEADER.size:
+        return None
+    file_magic, file_major, _, _, section_count = HEADER.unpack_from(data, 0)
+    if file_magic != magic or file_major != major:
+        return None
+    if len(data) < HEADER.size + section_count * SECTION.size:
+        return None
+
+    sections = {}
+    for i in range(section_count):
+        tag, offset, size = SECTION.unpack_from(data, HEADER.size + i * SECTION.size)
+        sections[tag] = memoryview(data)[offset : offset + size]
+    return sections
+
+
+def pack_strings(strings: Sequence[str]) -> Tuple[bytes, bytes]:
+    # STRO and STRS sections of a string table
+    encoded = [s.encode() for s in strings]
+    offsets = [0]
+    for s in encoded:
+        offsets.append(offsets[-1] + len(s))
+    return _to_bytes("I", offsets), b"".join(encoded)
+
+
+class StringTable:
+    def __init__(self, offsets: Sequence[int], blob):
+        self._offsets = offsets
+        self._blob = blob
+        self._cache: Dict[int, str] = {}
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        try:
+            return self._cache[i]
+        except KeyError:
+            s = bytes(self._blob[self._offsets[i] : self._offsets[i + 1]]).decode()
+            self._cache[i] = s
+            return s
+
+    def detach(self):
+        self._offsets = array("I", self._offsets)
+        self._blob = bytes(self._blob)
+
+
+class PrepareMergeSettings:
+    plugin_mapping: PluginMappingStore
+    selected_main_profile: str
+    mapping_fingerprint: str
+    version: Tuple[int, int, int]
+
+    VERSION = (2, 3, 0)
+    JSON_VERSION = (1, 1, 0)
+
+    def __init__(
+        self,
+        plugin_mapping=None,
+        selected_main_profile="",
+        mapping_fingerprint="",
+        version=VERSION,
+    ):
+        if plugin_mapping is None:
+            plugin_mapping = PluginMappingStore()
+        self.plugin_mapping = plugin_mapping
+        self.selected_main_profile = selected_main_profile
+        self.mapping_fingerprint = mapping_fingerprint
+        self.version = version
+        # None if not known, e.g. in settings of older versions
+        self.active_mods: Optional[List[str]] = None
+        self._master_graph: Optional[MasterGraph] = None
+        self._master_columns = None
+        self._mapped: Optional[mmap.mmap] = None
+        self._mapped_mapping: Optional[PluginMappingStore] = None
+        self._views: List[memoryview] = []
+
+    def from_json(self, data_json: str):
+        try:
+            data = json.loads(
+                data_json, object_hook=lambda o: PrepareMergeSettings(**o)
+            )
+            # version check to allow changes of the data structure in the future
+            if tuple(data.version) == self.JSON_VERSION:
+                self.plugin_mapping = PluginMappingStore(
+                    x for x in data.plugin_mapping if len(x) == 4
+                )
+                self.selected_main_profile = str(data.selected_main_profile)
+                self.mapping_fingerprint = str(data.mapping_fingerprint)
+                self.active_mods = None
+                return True
+        except (JSONDecodeError, TypeError):
+            pass
+        return False
+
+    def from_bytes(self, data) -> bool:
+        sections = unpack_sections(data, MAGIC, self.VERSION[0])
+        if sections is None:
+            return False
+        self._views.extend(sections.values())
+
+        def column(tag: bytes, typecode: str):
+            view = _to_array(typecode, sections[tag])
+            if isinstance(view, memoryview):
+                self._views.append(view)
+            return view
+
+        try:
+            strings = StringTable(column(STRING_OFFSETS, "I"), sections[STRINGS])
+            meta = column(META, "I")
+            self._mapped_mapping = PluginMappingStore.from_columns(
+                strings,
+                column(PLUGIN_PRIORITIES, "i"),
+                column(PLUGIN_NAMES, "I"),
+                column(MOD_PRIORITIES, "i"),
+                column(MOD_NAMES, "I"),
+                column(PLUGIN_ORDER, "I") if PLUGIN_ORDER in sections else None,
+                column(MOD_ORDER, "I") if MOD_ORDER in sections else None,
+            )
+            self.plugin_mapping = self._mapped_mapping
+            self.selected_main_profile = strings[meta[0]]
+            self.mapping_fingerprint = strings[meta[1]]
+            self.active_mods = None
+            if ACTIVE_MODS in sections:
+                self.active_mods = [strings[m] for m in column(ACTIVE_MODS, "I")]
+            self._master_graph = None
+            self._master_columns = None
+            if MASTER_OFFSETS in sections:
+                # Master graph is only built when it is used
+                self._master_columns = (
+                    self._mapped_mapping,
+                    strings,
+                    column(MASTER_OFFSETS, "I"),
+                    column(MASTERS, "I"),
+                    column(UNKNOWN_MASTERS, "I")
+                    if UNKNOWN_MASTERS in sections
+                    else (),
+                    column(MASTER_FLAGS, "I") if MASTER_FLAGS in sections else (),
+                )
+        except (KeyError, IndexError, TypeError):
+            # Truncated or corrupt file
+            self.plugin_mapping = PluginMappingStore()
+            return False
+        return True
+
+    def to_bytes(self) -> bytes:
+        string_ids: Dict[str, int] = {}
+
+        def string_id(s: str) -> int:
+            if s not in string_ids:
+                string_ids[s] = len(string_ids)
+            return string_ids[s]
+
+        meta = [
+            string_id(self.selected_main_profile),
+            string_id(self.mapping_fingerprint),
+        ]
+        plugin_priorities = []
+        plugin_names = []
+        mod_priorities = []
+        mod_names = []
+        master_graph = self.master_graph
+        master_offsets = [0]
+        masters = []
+        unknown_masters = []
+        master_flags = []
+        for row, (priority, plugin, priority_mod, mod) in enumerate(
+            self.plugin_mapping
+        ):
+            plugin_priorities.append(priority)
+            plugin_names.append(string_id(plugin))
+            mod_priorities.append(priority_mod)
+            mod_names.append(string_id(mod))
+            masters.extend(string_id(m) for m in master_graph.masters(plugin))
+            master_offsets.append(len(masters))
+            if plugin not in master_graph:
+                unknown_masters.append(row)
+            elif master_graph.has_master_flag(plugin):
+                master_flags.append(row)
+        active_mods = None
+        if self.active_mods is not None:
+            active_mods = [string_id(m) for m in self.active_mods]
+
+        string_offsets, string_blob = pack_strings(list(string_ids))
+        sections = [
+            (STRING_OFFSETS, string_offsets),
+            (STRINGS, string_blob),
+            (META, _to_bytes("I", meta)),
+            (PLUGIN_PRIORITIES, _to_bytes("i", plugin_priorities)),
+            (PLUGIN_NAMES, _to_bytes("I", plugin_names)),
+            (MOD_PRIORITIES, _to_bytes("i", mod_priorities)),
+            (MOD_NAMES, _to_bytes("I", mod_names)),
+            (PLUGIN_ORDER, _to_bytes("I", self.plugin_mapping.plugin_order)),
+            (MOD_ORDER, _to_bytes("I", self.plugin_mapping.mod_order)),
+        ]
+        if active_mods is not None:
+            sections.append((ACTIVE_MODS, _to_bytes("I", active_mods)))
+        if len(master_graph) > 0:
+            sections.append((MASTER_OFFSETS, _to_bytes("I", master_offsets)))
+            sections.append((MASTERS, _to_bytes("I", masters)))
+            if len(unknown_masters) > 0:
+                sections.append((UNKNOWN_MASTERS, _to_bytes("I", unknown_masters)))
+            if len(master_flags) > 0:
+                sections.append((MASTER_FLAGS, _to_bytes("I", master_flags)))
+
+        return pack_sections(MAGIC, self.VERSION, sections)
+
+    @property
+    def master_graph(self) -> MasterGraph:
+        if self._master_graph is None:
+            self._master_graph = MasterGraph()
+            if self._master_columns is not None:
+                (
+                    mapping,
+                    strings,
+                    offsets,
+                    masters,
+                    unknown,
+                    flags,
+                ) = self._master_columns
+                unknown = set(unknown)
+                flags = set(flags)
+                for i, (_, plugin, _, mod) in enumerate(mapping):
+                    if i in unknown:
+                        continue
+                    self._master_graph.add(
+                        plugin,
+                        [strings[m] for m in masters[offsets[i] : offsets[i + 1]]],
+                        mod,
+                        i in flags,
+                    )
+                self._master_columns = None
+        return self._master_graph
+
+    @master_graph.setter
+    def master_graph(self, graph: MasterGraph):
+        self._master_graph = graph
+        self._master_columns = None
+
+    @property
+    def has_master_graph(self) -> bool:
+        # Checked without building the graph from the stored columns
+        if self._master_columns is not None:
+            return True
+        return self._master_graph is not None and len(self._master_graph) > 0
+
+    def read_file(self, path: Path, migrate: bool = True):
+        # migrate: rewrite settings of older versions in the current format
+        self.close()
+        with path.open("rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                f.seek(0)
+                data_json = f.read().decode()
+            else:
+                data_json = None
+                self._mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if data_json is not None:
+            # Settings of older versions are stored as JSON -> migrate them
+            if not self.from_json(data_json):
+                return False
+            if migrate:
+                self.write_file(path)
+            return True
+
+        if not self.from_bytes(self._mapped):
+            self.close()
+            return False
+        return True
+
+    def write_file(self, path: Path, data: Optional[bytes] = None):
+        # data: result of to_bytes() if already serialized
+        if data is None:
+            data = self.to_bytes()
+        # A memory-mapped file cannot be replaced on Windows
+        self.close()
+        path.write_bytes(data)
+
+    def close(self):
+        if self._mapped is None:
+            return
+        # Everything still needed is copied out of the file first
+        if self._master_columns is not None:
+            # Build the master graph before its columns are released
+            self._master_graph = self.master_graph
+        # The mapping may still be referenced by the models
+        if self._mapped_mapping is not None:
+            self._mapped_mapping.detach()
+        for view in reversed(self._views):
+            view.release()
+        # Fails while views of the file are still exported, the state is only cleared
+        # once the file is closed, so closing can be tried again
+        self._mapped.close()
+        self._mapped = None
+        self._mapped_mapping = None
+        self._views.clear()
@@ -1,7 +1,7 @@
 import json
+import re
 import typing
-from collections import defaultdict
-from typing import List, Dict, Tuple
+from typing import Dict, Iterable, List, Optional, Tuple
 
 try:
     import PyQt6.QtCore as QtCore
@@ -12,10 +12,25 @@ except ImportError:
     from PyQt5.QtCore import Qt, QModelIndex
     from PyQt5.QtWidgets import QApplication
 
+from .plugin_mapping_store import PluginMappingStore
+from .plugin_mime_data import PluginMimeData
+
+
+class EntrySelection:
+    # Result of selecting plugins by name
+
+    def __init__(self):
+        # Store rows of the newly selected plugins
+        self.selected: List[int] = []
+        # Names of plugins that were selected before
+        self.already_selected: List[str] = []
+        # Names given more than once
+        self.duplicates: List[str] = []
+        # Names not found in the mapping, with similar plugin names
+        self.missing: Dict[str, List[str]] = {}
+
 
 class PrepareMergeTableModel(QtCore.QAbstractTableModel):
-    _data: List[Tuple[int, str, int, str]] = []
-    _selected: Dict[int, bool] = defaultdict(lambda: False)
     _header = ("Priority\n(Plugin)", "Plugin Name", "Priority\n(Mod)", "Mod Name")
     _alignments = (
         Qt.AlignmentFlag.AlignCenter,
@@ -24,14 +39,56 @@ class PrepareMergeTableModel(QtCore.QAbstractTableModel):
         Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignVCenter,
     )
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Rows of the table are the rows of the store
+        self._data = PluginMappingStore()
+        # One byte per row, set if the plugin was moved to the selected plugins
+        self._selected = bytearray()
+        self._similar_names: Optional[Dict[str, List[int]]] = None
+
     def __tr(self, name: str):
         return QApplication.translate("PrepareMerge", name)
 
-    def init_data(self, data):
-        self._data = data
-        self._selected.clear()
+    def init_data(self, store: PluginMappingStore):
+        self._data = store
+        self._selected = bytearray(len(store))
+        self._similar_names = None
         self.layoutChanged.emit()
 
+    @staticmethod
+    def _similar_keys(name: str) -> Tuple[str, str]:
+        # Name without the plugin extension, and without anything but letters and digits
+        name = name.casefold()
+        stem, ext = name.rsplit(".", 1) if "." in name else (name, "")
+        if ext not in ("esp", "esm", "esl"):
+            stem = name
+        return "stem:" + stem, "alnum:" + re.sub(r"[\W_]+", "", stem)
+
+    def _similar(self, name: str) -> List[str]:
+        if self._similar_names is None:
+            self._similar_names = {}
+            for row in range(len(self._data)):
+                for k in self._similar_keys(self._data.plugin(row)):
+                    self._similar_names.setdefault(k, []).append(row)
+        rows = set()
+        for k in self._similar_keys(name):
+            rows.update(self._similar_names.get(k, ()))
+        return [self._data.plugin(row) for row in sorted(rows)]
+
+    def _emit_rows_changed(self, rows: Iterable[int]):
+        # One dataChanged per contiguous range of changed rows
+        start = end = None
+        for row in sorted(rows):
+            if end is not None and row == end + 1:
+                end = row
+                continue
+            if start is not None:
+                self.dataChanged.emit(self.index(start, 0), self.index(end, 3))
+            start = end = row
+        if start is not None:
+            self.dataChanged.emit(self.index(start, 0), self.index(end, 3))
+
     def headerData(
         self, section: int, orientation: Qt.Orientation, role: int = ...
     ) -> typing.Any:
@@ -46,7 +103,7 @@ class PrepareMergeTableModel(QtCore.QAbstractTableModel):
 
     def data(self, index: QModelIndex, role: int = ...) -> typing.Any:
         if role == Qt.ItemDataRole.DisplayRole:
-            return self._data[index.row()][index.column()]
+            return self._data.cell(index.row(), index.column())
         elif role == Qt.ItemDataRole.TextAlignmentRole:
             return self._alignments[index.column()]
 
@@ -77,24 +134,18 @@ class PrepareMergeTableModel(QtCore.QAbstractTableModel):
             return False
 
         row = index.row()
-        self._selected[self._data[row][0]] = True
+        self._selected[row] = 1
 
-        self.dataChanged.emit(self.index(row, 0), self.index(row, 4))
+        self.dataChanged.emit(self.index(row, 0), self.index(row, 3))
 
         return True
 
     def isSelected(self, index: QModelIndex):
-        return self._selected[self._data[index.row()][0]]
+        return self._selected[index.row()] != 0
 
     def mimeData(self, indexes: typing.Iterable[QModelIndex]) -> QtCore.QMimeData:
-        mime_data = QtCore.QMimeData()
-        data = []
-        for i in indexes:
-            if i.column() == 0:
-                data.append(self._data[i.row()])
-        data_json = json.dumps(data)
-        mime_data.setData("application/json/table", data_json.encode())
-        return mime_data
+        rows = [i.row() for i in indexes if i.column() == 0]
+        return PluginMimeData(self, "application/json/table", self._data, rows)
 
     def mimeTypes(self) -> typing.List[str]:
         return ["application/json/list"]
@@ -113,30 +164,49 @@ class PrepareMergeTableModel(QtCore.QAbstractTableModel):
         if not data.hasFormat("application/json/list"):
             return False
 
-        data_json = data.data("application/json/list").data().decode()
-        new_data = json.loads(data_json)
-
-        if len(new_data) == 0 or len(new_data[0]) != 4:
-            return False
+        if isinstance(data, PluginMimeData) and data.store is self._data:
+            rows = data.rows
+        else:
+            data_json = data.data("application/json/list").data().decode()
+            new_data = json.loads(data_json)
+            if len(new_data) == 0 or len(new_data[0]) != 4:
+                return False
+            rows = [self._data.row_of_priority(d[0]) for d in new_data]
 
-        for d in new_data:
-            self._selected[d[0]] = False
+        changed = []
+        for row in rows:
+            if row >= 0 and self._selected[row]:
+                self._selected[row] = 0
+                changed.append(row)
 
-        self.dataChanged.emit(
-            self.index(0, 0), self.index(len(self._data), len(self._data))
-        )
+        self._emit_rows_changed(changed)
 
         return True
 
-    def selectEntry(self, text, column):
-        indices = self.match(self.index(0, column), Qt.ItemDataRole.DisplayRole, text)
-        if len(indices) == 1:
-            row = indices[0].row()
-            d = self._data[row]
-            if d[column] == text:
-                if not self._selected[d[0]]:
-                    self.setData(self.index(row, 0), None)
-                    return True, d
-                else:
-                    return True, None
-        return False, None
+    def selectEntries(self, names: Iterable[str]) -> EntrySelection:
+        result = EntrySelection()
+        seen = set()
+        changed = []
+        for name in names:
+            row = self._data.row_of_plugin(name)
+            if row < 0:
+                if name not in result.missing:
+                    result.missing[name] = self._similar(name)
+                continue
+            if row in seen:
+                result.duplicates.append(name)
+                continue
+            seen.add(row)
+            if self._selected[row]:
+                result.already_selected.append(name)
+            else:
+                self._selected[row] = 1
+                changed.append(row)
+                result.selected.append(row)
+
+        # A single signal for the whole import
+        if len(changed) > 0:
+            self.dataChanged.emit(
+                self.index(min(changed), 0), self.index(max(changed), 3)
+            )
+        return result
@@ -1,7 +1,4 @@
-import json
-from json import JSONDecodeError
 from pathlib import Path
-from typing import Tuple
 
 import mobase
 
@@ -18,64 +15,77 @@ except ImportError:
     from PyQt5.QtCore import Qt
     from PyQt5.QtWidgets import QApplication
 
-from .case_insensitive_dict import CaseInsensitiveDict
+from .master_cache import MasterCache
+from .master_graph import MasterGraph
+from .merge_planner import MergePlanner
 from .multi_filter_proxy_model import MultiFilterProxyModel, MultiFilterMode
+from .instrumentation import MergeReport
+from .mapping_worker import MappingBuildWorker
 from .prepare_merge_impl import (
     activate_plugins_impl,
-    create_plugin_mapping_impl,
-    PluginMapping,
+    plugin_mapping_fingerprint_impl,
+    snapshot_plugin_mapping_impl,
     PrepareMergeException,
 )
+from .plugin_list_parser import (
+    is_zmerge_file,
+    parse_plugin_lines,
+    read_plugin_groups,
+    read_plugin_list,
+)
+from .plugin_mapping_store import PluginMappingStore
 from .prepare_merge_list_model import PrepareMergeListModel
+from .prepare_merge_settings import PrepareMergeSettings
 from .prepare_merge_table_model import PrepareMergeTableModel
+from .profile_mapping_cache import ProfileMappingCache
 
 
-class PrepareMergeSettings:
-    plugin_mapping: PluginMapping
-    selected_main_profile: str
-    version: Tuple[int, int, int]
+def get_settings_path(organizer: mobase.IOrganizer) -> Path:
+    plugin_data = Path(organizer.getPluginDataPath())
+    return plugin_data / "merge-plugins" / "prepare_merge.settings"
 
-    def __init__(
-        self, plugin_mapping=None, selected_main_profile="", version=(1, 1, 0)
-    ):
-        if plugin_mapping is None:
-            plugin_mapping = list()
-        self.plugin_mapping = plugin_mapping
-        self.selected_main_profile = selected_main_profile
-        self.version = version
 
-    def to_json(self):
-        return json.dumps(self, default=lambda o: o.__dict__, sort_keys=True, indent=4)
+def get_master_cache_path(organizer: mobase.IOrganizer) -> Path:
+    return get_settings_path(organizer).with_name("master_cache.bin")
 
-    def from_json(self, data_json: str):
-        try:
-            data = json.loads(
-                data_json, object_hook=lambda o: PrepareMergeSettings(**o)
-            )
-            # version check to allow changes of the data structure in the future
-            if tuple(data.version) == self.version:
-                for x in data.plugin_mapping:
-                    if len(x) == 4:
-                        self.plugin_mapping.append(tuple(x))
-                self.selected_main_profile = str(data.selected_main_profile)
-        except JSONDecodeError:
-            pass
+
+def get_merge_report_path(organizer: mobase.IOrganizer) -> Path:
+    return get_settings_path(organizer).with_name("merge_report.json")
 
 
 class PrepareMergeWindow(QtWidgets.QDialog):
     def __tr(self, name: str):
         return QApplication.translate("PrepareMerge", name)
 
-    def __init__(self, organizer: mobase.IOrganizer, parent=None):
+    def __init__(
+        self,
+        organizer: mobase.IOrganizer,
+        settings: PrepareMergeSettings = None,
+        parent=None,
+    ):
         try:
             self.__organizer = organizer
-            self._settings = PrepareMergeSettings()
-            self.load_settings()
+            self._mapping_worker = None
+            if settings is None:
+                self._settings = PrepareMergeSettings()
+                self.load_settings()
+            else:
+                self._settings = settings
 
             super().__init__(parent)
 
+            self._profiles = ProfileMappingCache(
+                get_settings_path(organizer).parent / "profiles"
+            )
+            # Masters of plugin files, shared by all base profiles
+            self._master_cache = MasterCache()
+            self._master_cache.read_file(get_master_cache_path(organizer))
+
             self._table_model = PrepareMergeTableModel()
             self._list_model = PrepareMergeListModel()
+            self._planner = MergePlanner(
+                self._settings.plugin_mapping, self._lazy_master_graph()
+            )
 
             self._table_model_proxy = MultiFilterProxyModel()
             self._table_model_proxy.setMultiFilterMode(MultiFilterMode.OR)
@@ -110,17 +120,45 @@ class PrepareMergeWindow(QtWidgets.QDialog):
             filter_box.setClearButtonEnabled(True)
             filter_box.setPlaceholderText(self.__tr("Filter"))
 
-            def update_filter():
-                self._table_model_proxy.setFilterByColumn(1, filter_box.text())
-                self._table_model_proxy.setFilterByColumn(3, filter_box.text())
+            regex_box = QtWidgets.QCheckBox(self.__tr("Regex"))
+            regex_box.setToolTip(self.__tr("Filter with regular expressions instead of plain text"))
 
-            filter_box.textChanged.connect(update_filter)
+            def update_filter():
+                self._table_model_proxy.setRegexMode(regex_box.isChecked())
+                text = filter_box.text()
+                self._table_model_proxy.setFilters({1: text, 3: text})
+
+            # Filter once typing pauses, not on every keystroke
+            filter_timer = QtCore.QTimer(self)
+            filter_timer.setSingleShot(True)
+            filter_timer.setInterval(150)
+            filter_timer.timeout.connect(update_filter)
+
+            filter_box.textChanged.connect(filter_timer.start)
+            regex_box.toggled.connect(update_filter)
+
+            filter_layout = QtWidgets.QHBoxLayout()
+            filter_layout.addWidget(filter_box)
+            filter_layout.addWidget(regex_box)
+
+            self._mapping_progress = QtWidgets.QProgressBar()
+            self._mapping_progress.setFormat(self.__tr("Building plugin mapping... %p%"))
+            cancel_mapping_button = QtWidgets.QPushButton(self.__tr("Cancel"))
+            cancel_mapping_button.clicked.connect(self.cancel_mapping_build)
+            progress_layout = QtWidgets.QHBoxLayout()
+            progress_layout.setContentsMargins(0, 0, 0, 0)
+            progress_layout.addWidget(self._mapping_progress)
+            progress_layout.addWidget(cancel_mapping_button)
+            self._mapping_progress_widget = QtWidgets.QWidget()
+            self._mapping_progress_widget.setLayout(progress_layout)
+            self._mapping_progress_widget.hide()
 
             wrapper_left = QtWidgets.QWidget()
             layout_left = QtWidgets.QVBoxLayout()
             layout_left.addLayout(active_profile_layout)
             layout_left.addWidget(self._table_widget)
-            layout_left.addWidget(filter_box)
+            layout_left.addWidget(self._mapping_progress_widget)
+            layout_left.addLayout(filter_layout)
             wrapper_left.setLayout(layout_left)
 
             selected_plugins_label = QtWidgets.QLabel()
@@ -132,8 +170,13 @@ class PrepareMergeWindow(QtWidgets.QDialog):
             layout_right = QtWidgets.QVBoxLayout()
             layout_right.addWidget(selected_plugins_label)
             layout_right.addWidget(self.create_list_widget())
+            layout_right.addWidget(self.create_preview_label())
             import_button = self.create_import_button()
-            layout_right.addWidget(import_button)
+            import_file_button = self.create_import_file_button()
+            import_layout = QtWidgets.QHBoxLayout()
+            import_layout.addWidget(import_button)
+            import_layout.addWidget(import_file_button)
+            layout_right.addLayout(import_layout)
             wrapper_right.setLayout(layout_right)
             selected_plugins_label.setFixedHeight(20)  # same height as _active_profile
 
@@ -156,13 +199,8 @@ class PrepareMergeWindow(QtWidgets.QDialog):
             filter_box.setFixedHeight(25)
             filter_box.setContentsMargins(0, 1, 0, 1)
             import_button.setFixedHeight(25)
+            import_file_button.setFixedHeight(25)
             selected_plugins_label.setFixedHeight(active_profile_label.height())
-
-            def profile_changed(old: mobase.IProfile, _: mobase.IProfile) -> None:
-                if old:
-                    self.update_mapping(old.name())
-
-            self.__organizer.onProfileChanged(profile_changed)
         except Exception as ex:
             self.show_error(repr(ex), "Critical error! Please report this on Nexus / GitHub.",
                             QtWidgets.QMessageBox.Icon.Critical)
@@ -239,29 +277,192 @@ class PrepareMergeWindow(QtWidgets.QDialog):
 
         return button_layout
 
+    def create_preview_label(self):
+        self._preview_label = QtWidgets.QLabel()
+        self._preview_label.setWordWrap(True)
+
+        self._list_model.rowsInserted.connect(self.update_preview)
+        self._list_model.rowsRemoved.connect(self.update_preview)
+        self._list_model.rowsMoved.connect(self.update_preview)
+        self._list_model.layoutChanged.connect(self.update_preview)
+        self._list_model.modelReset.connect(self.update_preview)
+
+        return self._preview_label
+
+    def update_preview(self):
+        plugins = self.selected_plugins()
+        if len(plugins) == 0:
+            self._preview_label.clear()
+            self._preview_label.setToolTip("")
+            return
+
+        plan = self._planner.plan(plugins)
+        text = self.__tr("Enables {0} mods and {1} plugins.").format(
+            len(plan.mods), len(plan.plugins_to_activate)
+        )
+        if len(plan.missing) > 0:
+            text += " " + self.__tr("{0} plugins are missing in the base profile!").format(
+                len(plan.missing)
+            )
+        if len(plan.conflicts) > 0:
+            text += " " + self.__tr("{0} plugins cannot be ordered as listed!").format(
+                len(plan.conflicts)
+            )
+        self._preview_label.setText(text)
+
+        tooltip = f"Mods:\n{plan.mods}\n\nPlugins:\n{plan.plugins_to_activate}"
+        if len(plan.missing) > 0:
+            tooltip += f"\n\nMissing:\n{plan.missing}"
+        if len(plan.conflicts) > 0:
+            conflicts = [f"{p} -> {m}" for p, m in plan.conflicts]
+            tooltip += (
+                "\n\nPlugins placed after plugins they have to load before:"
+                f"\n{conflicts}"
+            )
+        self._preview_label.setToolTip(tooltip)
+
     def update_table_view(self):
+        self._planner = MergePlanner(
+            self._settings.plugin_mapping, self._lazy_master_graph()
+        )
         self._table_model.init_data(self._settings.plugin_mapping)
-        self._list_model.init_data([])
+        self._list_model.init_data(self._settings.plugin_mapping)
 
         self._table_widget.sortByColumn(0, Qt.SortOrder.AscendingOrder)
         self._table_widget.resizeColumnToContents(1)
         self._table_widget.resizeColumnToContents(3)
 
+    def _lazy_master_graph(self):
+        # The stored graph is only decoded when the first merge is planned
+        settings = self._settings
+        return lambda: settings.master_graph
+
     def update_mapping(self, current_profile: str):
         if self._settings.selected_main_profile == current_profile:
-            self._settings.plugin_mapping.clear()
-            self._settings.plugin_mapping.extend(
-                create_plugin_mapping_impl(self.__organizer)
-            )
+            fingerprint = plugin_mapping_fingerprint_impl(self.__organizer)
+            if (
+                self._settings.plugin_mapping
+                and self._settings.has_master_graph
+                and self._settings.mapping_fingerprint == fingerprint
+            ):
+                # Load order did not change since the mapping was stored
+                self._active_profile.setText(self._settings.selected_main_profile)
+                return
+
+            # Only reading MO2 happens here, the mapping is built by a worker thread
+            if self._settings.plugin_mapping and self._settings.has_master_graph:
+                snapshot = snapshot_plugin_mapping_impl(
+                    self.__organizer,
+                    self._settings.plugin_mapping,
+                    with_masters=True,
+                    active_mods=self._settings.active_mods,
+                )
+                master_graph = self._settings.master_graph.copy()
+            else:
+                snapshot = snapshot_plugin_mapping_impl(
+                    self.__organizer, with_masters=True
+                )
+                master_graph = None
+            snapshot.profile = current_profile
             self._active_profile.setText(self._settings.selected_main_profile)
-            self.store_settings()
+            self.start_mapping_build(snapshot, master_graph)
+
+    def start_mapping_build(self, snapshot, master_graph):
+        self.cancel_mapping_build()
+
+        worker = MappingBuildWorker(
+            snapshot,
+            master_graph,
+            self._master_cache,
+            get_master_cache_path(self.__organizer),
+            self,
+        )
+        worker.progress.connect(self.show_mapping_progress)
+        worker.built.connect(lambda result: self.mapping_built(worker, result))
+        worker.failed.connect(
+            lambda message: self.show_error(
+                message,
+                "Critical error! Please report this on Nexus / GitHub.",
+                QtWidgets.QMessageBox.Icon.Critical,
+            )
+        )
+        worker.finished.connect(lambda: self.mapping_build_finished(worker))
+        self._mapping_worker = worker
+
+        self._mapping_progress.setValue(0)
+        self._mapping_progress_widget.show()
+        worker.start()
+
+    def cancel_mapping_build(self):
+        worker = self._mapping_worker
+        if worker is not None:
+            self._mapping_worker = None
+            worker.requestInterruption()
+            worker.wait()
+            self._mapping_progress_widget.hide()
+
+    def show_mapping_progress(self, done: int, total: int):
+        self._mapping_progress.setMaximum(total)
+        self._mapping_progress.setValue(done)
+
+    def mapping_build_finished(self, worker):
+        if worker is self._mapping_worker:
+            self._mapping_worker = None
+            self._mapping_progress_widget.hide()
+        worker.deleteLater()
+
+    def mapping_built(self, worker, result):
+        # Results of cancelled builds or of another base profile are dropped
+        if (
+            worker is not self._mapping_worker
+            or result.profile != self._settings.selected_main_profile
+        ):
+            return
+
+        QtCore.qInfo(
+            f"Updated plugin mapping of '{result.profile}': {result.changes}".encode(
+                "ascii", "replace"
+            ).decode("ascii")
+        )
+        for plugin, reason in result.unreadable.items():
+            QtCore.qWarning(
+                f"Could not read the masters of '{plugin}': {reason}".encode(
+                    "ascii", "replace"
+                ).decode("ascii")
+            )
+        selected_plugins = self.selected_plugins()
+
+        # Swap in the new mapping, the models only ever see complete mappings
+        self._settings.plugin_mapping = result.mapping
+        self._settings.master_graph = result.master_graph
+        self._settings.mapping_fingerprint = result.fingerprint
+        self._settings.active_mods = result.active_mods
+        self.store_settings(result.data)
+        self.update_table_view()
+
+        # Keep the plugins selected before
+        if len(selected_plugins) > 0:
+            selection = self._table_model.selectEntries(selected_plugins)
+            self._list_model.insertEntries(0, selection.selected)
 
     def select_current_profile(self):
         try:
-            self._settings.selected_main_profile = self.__organizer.profile().name()
+            current_profile = self.__organizer.profile().name()
+            self.cancel_mapping_build()
+            if self._settings.selected_main_profile == current_profile:
+                # Selecting the base profile again explicitly rebuilds the full mapping
+                self._settings.plugin_mapping = PluginMappingStore()
+                self._settings.master_graph = MasterGraph()
+                self._settings.mapping_fingerprint = ""
+                self._settings.active_mods = None
+            else:
+                # Keep the mapping of the previous base profile and switch to the
+                # cached mapping of the new one, which is only updated if needed
+                self._profiles.store(self._settings)
+                self._settings = self._profiles.get(current_profile)
             self.store_settings()
 
-            self.update_mapping(self.__organizer.profile().name())
+            self.update_mapping(current_profile)
             self.update_table_view()
         except Exception as ex:
             self.show_error(repr(ex), self.__tr("Critical error! Please report this on Nexus / GitHub."),
@@ -284,11 +485,13 @@ class PrepareMergeWindow(QtWidgets.QDialog):
         if value == QtWidgets.QMessageBox.StandardButton.Yes:
             self.activate_plugins()
 
-    def show_success(self, active_plugins, active_mods):
+    def show_success(self, active_plugins, active_mods, report: MergeReport = None):
         info_box = QtWidgets.QMessageBox()
         info_box.setWindowTitle(self.__tr("Prepare Merge"))
         info_box.setText(self.__tr("Success! The following mods and plugins were activated:"))
         info_box.setInformativeText(f"Mods:\n{str(active_mods)}\n\nPlugins:\n{str(active_plugins)}")
+        if report is not None:
+            info_box.setDetailedText(report.format())
         info_box.setStandardButtons(QtWidgets.QMessageBox.StandardButton.Ok)
         info_box.exec()
 
@@ -301,23 +504,32 @@ class PrepareMergeWindow(QtWidgets.QDialog):
         info_box.setStandardButtons(QtWidgets.QMessageBox.StandardButton.Ok)
         info_box.exec()
 
+    def selected_plugins(self):
+        return [
+            self._list_model.data(self._list_model.index(i, 1), Qt.ItemDataRole.DisplayRole)
+            for i in range(self._list_model.rowCount())
+        ]
+
     def activate_plugins(self):
         try:
-            plugins = [
-                self._list_model.data(self._list_model.index(i, 1), Qt.ItemDataRole.DisplayRole)
-                for i in range(self._list_model.rowCount())
-            ]
-            plugin_to_mod = CaseInsensitiveDict()
+            report = MergeReport()
+            with report.phase("plan merge"):
+                plan = self._planner.plan(self.selected_plugins())
 
-            for _, p, _, m in self._settings.plugin_mapping:
-                plugin_to_mod[p] = m
+            (active_plugins, active_mods, order_correct) = activate_plugins_impl(
+                self.__organizer, plan, report
+            )
 
-            (active_plugins, active_mods, order_correct) = activate_plugins_impl(self.__organizer, plugins, plugin_to_mod)
+            QtCore.qInfo(f"Merge took {report.total_ms:.1f} ms, {report.total_calls} MO2 calls")
+            try:
+                report.write_json(get_merge_report_path(self.__organizer))
+            except OSError as ex:
+                QtCore.qWarning(f"Could not write the merge report: {ex}")
 
             if not order_correct:
                 self.show_warning_plugin_order()
 
-            self.show_success(active_plugins, active_mods)
+            self.show_success(active_plugins, active_mods, report)
 
         except PrepareMergeException as ex:
             self.show_error(
@@ -339,19 +551,14 @@ class PrepareMergeWindow(QtWidgets.QDialog):
         exception_box.exec()
 
     def load_settings(self):
-        plugin_data = Path(self.__organizer.getPluginDataPath())
-        settings_path = plugin_data / "merge-plugins" / "prepare_merge.settings"
+        settings_path = get_settings_path(self.__organizer)
         if settings_path.exists():
-            settings_file = settings_path.read_text()
-            self._settings.from_json(settings_file)
+            self._settings.read_file(settings_path)
 
-    def store_settings(self):
-        plugin_data = Path(self.__organizer.getPluginDataPath())
-        settings_path = plugin_data / "merge-plugins"
-        settings_path.mkdir(parents=True, exist_ok=True)
-        settings_path /= "prepare_merge.settings"
-        settings_file = self._settings.to_json()
-        settings_path.write_text(settings_file)
+    def store_settings(self, data=None):
+        settings_path = get_settings_path(self.__organizer)
+        settings_path.parent.mkdir(parents=True, exist_ok=True)
+        self._settings.write_file(settings_path, data)
 
     def create_import_button(self):
         import_button = QtWidgets.QPushButton(
@@ -360,30 +567,80 @@ class PrepareMergeWindow(QtWidgets.QDialog):
         import_button.clicked.connect(self.import_list)
         return import_button
 
+    def create_import_file_button(self):
+        import_file_button = QtWidgets.QPushButton(
+            self.__tr("Import entries from &file"), self
+        )
+        import_file_button.clicked.connect(self.import_file)
+        return import_file_button
+
     def import_list(self):
+        clipboard = QtGui.QGuiApplication.clipboard()
+        self.import_entries(parse_plugin_lines(clipboard.text().split("\n")))
+
+    def import_file(self):
+        try:
+            path, _ = QtWidgets.QFileDialog.getOpenFileName(
+                self,
+                self.__tr("Import plugin list"),
+                "",
+                self.__tr("Plugin lists (*.txt);;Merge groups, zMerge merges (*.json);;All files (*)"),
+            )
+            if not path:
+                return
+
+            if not is_zmerge_file(path):
+                self.import_entries(read_plugin_list(path))
+                return
+
+            try:
+                merges = read_plugin_groups(path)
+            except (ValueError, TypeError, AttributeError, KeyError) as ex:
+                self.show_error(
+                    f"'{path}' is not a list of merges: {ex}", "Import failed!"
+                )
+                return
+            if len(merges) == 0:
+                self.show_error(f"No merges found in '{path}'", "Import failed!")
+                return
+            merge_name = next(iter(merges))
+            if len(merges) > 1:
+                merge_name, ok = QtWidgets.QInputDialog.getItem(
+                    self,
+                    self.__tr("Import zMerge merge"),
+                    self.__tr("Merge:"),
+                    list(merges),
+                    0,
+                    False,
+                )
+                if not ok:
+                    return
+            self.import_entries(merges[merge_name])
+        except Exception as ex:
+            self.show_error(repr(ex), "Critical error! Please report this on Nexus / GitHub.",
+                            QtWidgets.QMessageBox.Icon.Critical)
+
+    def import_entries(self, names):
         try:
-            clipboard = QtGui.QGuiApplication.clipboard()
-            text = clipboard.text().split("\n")
-
-            valid_entries = []
-            invalid_entries = []
-            for e in text:
-                e_cleaned = e.strip()
-                if len(e_cleaned) == 0:
-                    continue
-                s, d = self._table_model.selectEntry(e_cleaned, 1)
-                if s and d:
-                    valid_entries.append(d)
-                elif s:
-                    QtCore.qInfo(f"Plugin already selected: '{e_cleaned}'".encode('ascii', 'replace').decode('ascii'))
-                else:
-                    QtCore.qWarning(f"Plugin does not exist: '{e_cleaned}'".encode('ascii', 'replace').decode('ascii'))
-                    invalid_entries.append(e_cleaned)
-
-            if len(invalid_entries) > 0:
+            selection = self._table_model.selectEntries(names)
+
+            for name in selection.already_selected:
+                QtCore.qInfo(f"Plugin already selected: '{name}'".encode('ascii', 'replace').decode('ascii'))
+            for name in selection.duplicates:
+                QtCore.qInfo(f"Plugin listed more than once: '{name}'".encode('ascii', 'replace').decode('ascii'))
+            for name in selection.missing:
+                QtCore.qWarning(f"Plugin does not exist: '{name}'".encode('ascii', 'replace').decode('ascii'))
+
+            if len(selection.missing) > 0:
+                invalid_entries = []
+                for name, similar in selection.missing.items():
+                    if len(similar) > 0:
+                        invalid_entries.append(f"{name} (did you mean {', '.join(similar)}?)")
+                    else:
+                        invalid_entries.append(name)
                 self.show_error(f"The following plugins do not exist:\n{invalid_entries}", "Import failed!")
 
-            self._list_model.insertEntries(self._list_model.rowCount(), valid_entries)
+            self._list_model.insertEntries(self._list_model.rowCount(), selection.selected)
         except Exception as ex:
             self.show_error(repr(ex), "Critical error! Please report this on Nexus / GitHub.",
                             QtWidgets.QMessageBox.Icon.Critical)
@@ -0,0 +1,62 @@
+import re
+from collections import OrderedDict
+from pathlib import Path
+
+from .prepare_merge_settings import PrepareMergeSettings
+
+
+class ProfileMappingCache:
+    # Plugin mappings of base profiles, stored as one settings file per profile.
+    # Files are loaded on first use and at most `capacity` mappings are kept in
+    # memory, the least recently used one is closed first.
+
+    def __init__(self, directory: Path, capacity: int = 4):
+        self._directory = directory
+        self._capacity = capacity
+        self._entries: "OrderedDict[str, PrepareMergeSettings]" = OrderedDict()
+
+    def path(self, profile: str) -> Path:
+        return self._directory / (re.sub(r'[<>:"/\\|?*]', "_", profile) + ".settings")
+
+    def get(self, profile: str) -> PrepareMergeSettings:
+        settings = self._entries.get(profile)
+        if settings is not None:
+            self._entries.move_to_end(profile)
+            return settings
+
+        settings = PrepareMergeSettings(selected_main_profile=profile)
+        path = self.path(profile)
+        if path.exists():
+            if (
+                not settings.read_file(path)
+                or settings.selected_main_profile != profile
+            ):
+                settings.close()
+                settings = PrepareMergeSettings(selected_main_profile=profile)
+        self._insert(profile, settings)
+        return settings
+
+    def store(self, settings: PrepareMergeSettings):
+        profile = settings.selected_main_profile
+        if len(profile) == 0:
+            return
+        self._directory.mkdir(parents=True, exist_ok=True)
+        settings.write_file(self.path(profile))
+        self._insert(profile, settings)
+
+    def _insert(self, profile: str, settings: PrepareMergeSettings):
+        previous = self._entries.pop(profile, None)
+        if previous is not None and previous is not settings:
+            previous.close()
+        self._entries[profile] = settings
+        while len(self._entries) > self._capacity:
+            _, evicted = self._entries.popitem(last=False)
+            evicted.close()
+
+    def __contains__(self, profile: str):
+        return profile in self._entries or self.path(profile).exists()
+
+    def close(self):
+        for settings in self._entries.values():
+            settings.close()
+        self._entries.clear()
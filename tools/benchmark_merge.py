@@ -0,0 +1,181 @@
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import fake_mobase
+from plugin_package import load_plugin_module
+
+# Wall time and MO2 API calls per phase of the merge engine, on synthetic load orders:
+#   python tools/benchmark_merge.py --plugins 10000 --mods 5000 --chain-depth 50
+
+
+class PhaseTimer:
+    def __init__(self, organizer: fake_mobase.FakeOrganizer):
+        self._organizer = organizer
+        self.results: List[Dict] = []
+
+    def run(self, name: str, func, *args):
+        self._organizer.calls.clear()
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        self.results.append(
+            {
+                "phase": name,
+                "ms": round(elapsed * 1000, 3),
+                "calls": dict(sorted(self._organizer.calls.items())),
+            }
+        )
+        return result
+
+
+def run_benchmark(
+    plugin_count: int,
+    mod_count: int,
+    chain_depth: int,
+    merge_size: int,
+    moved_mods: int,
+    seed: int,
+    plugin_files: bool = False,
+) -> List[Dict]:
+    fake_mobase.install()
+    impl = load_plugin_module("prepare_merge_impl")
+    settings_module = load_plugin_module("prepare_merge_settings")
+    planner_module = load_plugin_module("merge_planner")
+    builder = load_plugin_module("mapping_builder")
+
+    load_order = fake_mobase.SyntheticLoadOrder(
+        plugin_count, mod_count, chain_depth, seed=seed
+    )
+    organizer = fake_mobase.FakeOrganizer(load_order, plugin_files=plugin_files)
+    timer = PhaseTimer(organizer)
+
+    # Mapping and master graph as built by the window: MO2 is only read by the
+    # snapshot, masters come from the plugin headers with --plugin-files
+    def build(name: str, previous=None):
+        mapping = graph = active_mods = None
+        if previous is not None:
+            mapping, graph = previous.mapping, previous.master_graph
+            active_mods = previous.active_mods
+        snapshot = timer.run(
+            f"snapshot ({name})",
+            impl.snapshot_plugin_mapping_impl,
+            organizer,
+            mapping,
+            True,
+            active_mods,
+        )
+        return timer.run(
+            f"build settings ({name})",
+            lambda: builder.build_settings(
+                snapshot, graph.copy() if graph is not None else None
+            ),
+        )
+
+    result = build("full")
+    timer.run("fingerprint", impl.plugin_mapping_fingerprint_impl, organizer)
+    result = build("unchanged", result)
+
+    # Move some mods to the top, which changes the priority of all other mods
+    modlist = organizer.modList()
+    for m in load_order.mods[-moved_mods:]:
+        modlist.setPriority(m, 0)
+    result = build(f"{moved_mods} mods moved", result)
+    mapping, graph = result.mapping, result.master_graph
+
+    settings_path = Path(organizer.getPluginDataPath()) / "prepare_merge.settings"
+    settings_path.parent.mkdir(parents=True, exist_ok=True)
+    settings = settings_module.PrepareMergeSettings(mapping, "Base")
+    settings.master_graph = graph
+    timer.run("store settings", settings.write_file, settings_path)
+
+    def load_settings():
+        loaded = settings_module.PrepareMergeSettings()
+        loaded.read_file(settings_path)
+        # Decode everything, not just the header
+        list(loaded.plugin_mapping)
+        loaded.master_graph
+        loaded.close()
+        return loaded
+
+    timer.run("load settings", load_settings)
+
+    # Last plugins of the master chains need the deepest resolution
+    selection = [
+        p
+        for i, p in enumerate(load_order.plugins)
+        if i % chain_depth == chain_depth - 1
+    ][-merge_size:]
+    planner = planner_module.MergePlanner(mapping, graph)
+    plan = timer.run("plan merge", planner.plan, selection)
+    timer.run("plan merge (memoized)", planner.plan, selection)
+
+    # Like the window: preview a merge with the loaded settings, then store them
+    def plan_and_store_loaded():
+        loaded = settings_module.PrepareMergeSettings()
+        loaded.read_file(settings_path)
+        loaded_planner = planner_module.MergePlanner(
+            loaded.plugin_mapping, loaded.master_graph
+        )
+        loaded_planner.plan(selection)
+        loaded.write_file(settings_path)
+
+    timer.run("plan and store loaded settings", plan_and_store_loaded)
+
+    timer.run("activate plugins", impl.activate_plugins_impl, organizer, plan)
+
+    return timer.results
+
+
+def print_results(results: List[Dict]):
+    width = max(len(r["phase"]) for r in results)
+    for r in results:
+        calls = sum(r["calls"].values())
+        print(f"{r['phase']:<{width}}  {r['ms']:>10.1f} ms  {calls:>8} calls")
+        for name, count in r["calls"].items():
+            print(f"{'':<{width}}  {'':>13}  {count:>8}  {name}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the merge engine.")
+    parser.add_argument("--plugins", type=int, default=4000)
+    parser.add_argument("--mods", type=int, default=2000)
+    parser.add_argument("--chain-depth", type=int, default=8)
+    parser.add_argument("--merge-size", type=int, default=100)
+    parser.add_argument("--moved-mods", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--plugin-files",
+        action="store_true",
+        help="write the plugins to disk and read their masters from the headers",
+    )
+    parser.add_argument("--json", type=Path, help="also write the results to a file")
+    args = parser.parse_args(argv)
+
+    try:
+        from PyQt6.QtCore import qInstallMessageHandler
+    except ImportError:
+        from PyQt5.QtCore import qInstallMessageHandler
+    # Silence the qInfo logging of the merge engine
+    qInstallMessageHandler(lambda *_: None)
+
+    results = run_benchmark(
+        args.plugins,
+        args.mods,
+        args.chain_depth,
+        args.merge_size,
+        args.moved_mods,
+        args.seed,
+        args.plugin_files,
+    )
+    print_results(results)
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=4))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,363 @@
+import random
+import struct
+import sys
+import tempfile
+from collections import Counter
+from enum import IntEnum, IntFlag
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Set, Union
+
+# In-memory stand-in for the parts of MO2's mobase module used by the merge engine.
+# Load orders are synthetic and every IPluginList / IModList call is counted.
+
+GAME_PLUGINS = (
+    "Skyrim.esm",
+    "Update.esm",
+    "Dawnguard.esm",
+    "HearthFires.esm",
+    "Dragonborn.esm",
+)
+DATA_ORIGIN = "data"
+
+
+def write_plugin_file(path: Path, masters: Iterable[str], flags: int = 0):
+    # Minimal plugin: a TES4 record with HEDR, MAST / DATA pairs and nothing else
+    body = struct.pack("<4sHfII", b"HEDR", 12, 1.7, 0, 0x800)
+    for master in masters:
+        name = master.encode("cp1252") + b"\0"
+        body += struct.pack("<4sH", b"MAST", len(name)) + name
+        body += struct.pack("<4sHQ", b"DATA", 8, 0)
+    header = struct.pack("<4sIIIIHH", b"TES4", len(body), flags, 0, 0, 44, 0)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(header + body)
+
+
+class PluginState(IntEnum):
+    MISSING = 0
+    INACTIVE = 1
+    ACTIVE = 2
+
+
+class ModState(IntFlag):
+    EXISTS = 0x1
+    ACTIVE = 0x2
+    ESSENTIAL = 0x4
+    EMPTY = 0x8
+    ENDORSED = 0x10
+    VALID = 0x20
+    ALTERNATE = 0x40
+
+
+class IPlugin:
+    pass
+
+
+class IPluginTool(IPlugin):
+    pass
+
+
+class IProfile:
+    pass
+
+
+class IPluginList:
+    pass
+
+
+class IModList:
+    pass
+
+
+class IOrganizer:
+    pass
+
+
+def install():
+    # Make "import mobase" resolve to this module
+    sys.modules["mobase"] = sys.modules[__name__]
+
+
+def _is_master(plugin: str) -> bool:
+    return plugin.lower().endswith(".esm")
+
+
+def _counted(method):
+    name = method.__name__
+
+    def wrapper(self, *args, **kwargs):
+        self._calls[f"{self.INTERFACE}.{name}"] += 1
+        self._organizer._update()
+        return method(self, *args, **kwargs)
+
+    wrapper.__name__ = name
+    return wrapper
+
+
+class SyntheticLoadOrder:
+    # Plugins spread over mods, with master chains of the given depth
+
+    def __init__(
+        self,
+        plugin_count: int = 4000,
+        mod_count: int = 2000,
+        chain_depth: int = 8,
+        extra_master_chance: float = 0.1,
+        seed: int = 0,
+    ):
+        rng = random.Random(seed)
+
+        self.mods: List[str] = [f"Mod {i:05d}" for i in range(mod_count)]
+        self.mod_plugins: Dict[str, List[str]] = {m: [] for m in self.mods}
+        self.masters: Dict[str, List[str]] = {p: [] for p in GAME_PLUGINS}
+        self.plugins: List[str] = []
+
+        for i in range(plugin_count):
+            head = i % chain_depth == 0
+            plugin = f"Plugin {i:05d}.{'esm' if head else 'esp'}"
+            masters = [GAME_PLUGINS[0], GAME_PLUGINS[1]]
+            if not head:
+                masters.append(self.plugins[-1])
+            if i > chain_depth and rng.random() < extra_master_chance:
+                extra = self.plugins[rng.randrange(i - chain_depth)]
+                # Masters only depend on masters
+                if extra not in masters and (not head or _is_master(extra)):
+                    masters.append(extra)
+            self.masters[plugin] = masters
+            self.plugins.append(plugin)
+            # Plugins of a chain are usually shipped by neighbouring mods
+            mod = self.mods[min(mod_count - 1, i * mod_count // plugin_count)]
+            self.mod_plugins[mod].append(plugin)
+
+
+class FakeProfile(IProfile):
+    def __init__(self, name: str, path: Path):
+        self._name = name
+        self._path = path
+
+    def name(self) -> str:
+        return self._name
+
+    def absolutePath(self) -> str:
+        return str(self._path)
+
+
+class FakeOrganizer(IOrganizer):
+    def __init__(
+        self,
+        load_order: SyntheticLoadOrder,
+        profile: str = "Base",
+        data_path: Optional[Path] = None,
+        plugin_files: bool = False,
+    ):
+        if data_path is None:
+            data_path = Path(tempfile.mkdtemp(prefix="merge-plugins-"))
+        self.calls: Counter = Counter()
+        self.load_order = load_order
+        self._data_path = data_path
+        self._profile = FakeProfile(profile, data_path / "profiles" / profile)
+        Path(self._profile.absolutePath()).mkdir(parents=True, exist_ok=True)
+        self._callbacks: List[Callable] = []
+
+        self._mod_index = dict((m, i) for i, m in enumerate(load_order.mods))
+        self._active_mods: Set[str] = set(load_order.mods)
+        # Global load order of all plugins, also of disabled mods, like loadorder.txt.
+        # Masters come first, as MO2 keeps them in front of regular plugins.
+        self._load_order: List[str] = list(GAME_PLUGINS) + sorted(
+            load_order.plugins, key=lambda p: not _is_master(p)
+        )
+        self._states: Dict[str, PluginState] = {}
+        self._plugin_list = FakePluginList(self)
+        self._mod_list = FakeModList(self)
+        # Without plugin files, resolvePath finds nothing, like for missing files
+        self._plugin_files: Dict[str, Path] = {}
+        if plugin_files:
+            self._write_plugin_files()
+        self.refresh()
+
+    def _write_plugin_files(self):
+        masters = self.load_order.masters
+        for p in GAME_PLUGINS:
+            path = self._data_path / "game" / "Data" / p
+            write_plugin_file(path, masters[p], 1)
+            self._plugin_files[p] = path
+        for m, plugins in self.load_order.mod_plugins.items():
+            for p in plugins:
+                path = self._data_path / "mods" / m / p
+                write_plugin_file(path, masters[p], 1 if p.endswith(".esm") else 0)
+                self._plugin_files[p] = path
+
+    def refresh(self):
+        # Recomputed on the next plugin list access, like MO2 refreshing once after
+        # several mod changes
+        self._dirty = True
+
+    def _update(self):
+        if not self._dirty:
+            return
+        self._dirty = False
+        origins = dict((p, DATA_ORIGIN) for p in GAME_PLUGINS)
+        # Mods are sorted by priority, so the winning mod is assigned last
+        for m in self.load_order.mods:
+            if m in self._active_mods:
+                for p in self.load_order.mod_plugins[m]:
+                    origins[p] = m
+        self._origins = origins
+        self._present = [p for p in self._load_order if p in origins]
+        self._priorities = dict((p, i) for i, p in enumerate(self._present))
+        for p in self._present:
+            self._states.setdefault(p, PluginState.ACTIVE)
+
+    def pluginList(self) -> "FakePluginList":
+        return self._plugin_list
+
+    def modList(self) -> "FakeModList":
+        return self._mod_list
+
+    def profile(self) -> FakeProfile:
+        return self._profile
+
+    def resolvePath(self, name: str) -> str:
+        self.calls["IOrganizer.resolvePath"] += 1
+        self._update()
+        # Only files of active mods are visible
+        if name not in self._origins or name not in self._plugin_files:
+            return ""
+        return str(self._plugin_files[name])
+
+    def getPluginDataPath(self) -> str:
+        return str(self._data_path / "plugins" / "data")
+
+    def onProfileChanged(self, callback: Callable) -> bool:
+        self._callbacks.append(callback)
+        return True
+
+    def pluginSetting(self, plugin: str, key: str):
+        return True
+
+
+class FakePluginList(IPluginList):
+    INTERFACE = "IPluginList"
+
+    def __init__(self, organizer: FakeOrganizer):
+        self._organizer = organizer
+        self._calls = organizer.calls
+
+    @_counted
+    def pluginNames(self) -> List[str]:
+        return list(self._organizer._present)
+
+    @_counted
+    def origin(self, name: str) -> str:
+        return self._organizer._origins.get(name, "")
+
+    @_counted
+    def priority(self, name: str) -> int:
+        return self._organizer._priorities.get(name, -1)
+
+    @_counted
+    def setPriority(self, name: str, priority: int) -> bool:
+        o = self._organizer
+        if name not in o._priorities:
+            return False
+        present = [p for p in o._present if p != name]
+        # Like MO2, a plugin cannot be moved in front of its masters
+        index = dict((p, i) for i, p in enumerate(present))
+        lowest = max(
+            (index[m] + 1 for m in o.load_order.masters.get(name, ()) if m in index),
+            default=0,
+        )
+        priority = min(max(priority, lowest), len(present))
+        # and masters stay in front of regular plugins
+        if _is_master(name):
+            while priority > 0 and not _is_master(present[priority - 1]):
+                priority -= 1
+        else:
+            while priority < len(present) and _is_master(present[priority]):
+                priority += 1
+        target = present[priority - 1] if priority > 0 else None
+
+        o._load_order.remove(name)
+        index = o._load_order.index(target) + 1 if target is not None else 0
+        o._load_order.insert(index, name)
+        o.refresh()
+        return True
+
+    @_counted
+    def state(self, name: str) -> PluginState:
+        if name not in self._organizer._priorities:
+            return PluginState.MISSING
+        return self._organizer._states[name]
+
+    @_counted
+    def setState(self, name: str, state: PluginState):
+        # Plugins of the game are mandatory
+        if name in self._organizer._priorities and name not in GAME_PLUGINS:
+            self._organizer._states[name] = state
+
+    @_counted
+    def masters(self, name: str) -> List[str]:
+        # MO2 only knows the masters of plugins in the current load order
+        if name not in self._organizer._priorities:
+            return []
+        return list(self._organizer.load_order.masters.get(name, ()))
+
+    @_counted
+    def isMaster(self, name: str) -> bool:
+        return _is_master(name)
+
+
+class FakeModList(IModList):
+    INTERFACE = "IModList"
+
+    def __init__(self, organizer: FakeOrganizer):
+        self._organizer = organizer
+        self._calls = organizer.calls
+
+    @_counted
+    def allMods(self) -> List[str]:
+        return list(self._organizer.load_order.mods)
+
+    @_counted
+    def allModsByProfilePriority(self) -> List[str]:
+        return list(self._organizer.load_order.mods)
+
+    @_counted
+    def priority(self, name: str) -> int:
+        return self._organizer._mod_index.get(name, -1)
+
+    @_counted
+    def state(self, name: str) -> ModState:
+        o = self._organizer
+        if name not in o._mod_index:
+            return ModState(0)
+        state = ModState.EXISTS | ModState.VALID
+        if name in o._active_mods:
+            state |= ModState.ACTIVE
+        return state
+
+    @_counted
+    def setPriority(self, name: str, priority: int) -> bool:
+        o = self._organizer
+        if name not in o._mod_index:
+            return False
+        o.load_order.mods.remove(name)
+        o.load_order.mods.insert(priority, name)
+        o._mod_index = dict((m, i) for i, m in enumerate(o.load_order.mods))
+        o.refresh()
+        return True
+
+    @_counted
+    def setActive(self, names: Union[str, Iterable[str]], active: bool) -> int:
+        o = self._organizer
+        if isinstance(names, str):
+            names = [names]
+        changed = 0
+        for m in names:
+            if m in o._mod_index and (m in o._active_mods) != active:
+                if active:
+                    o._active_mods.add(m)
+                else:
+                    o._active_mods.discard(m)
+                changed += 1
+        o.refresh()
+        return changed
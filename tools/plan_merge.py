@@ -0,0 +1,82 @@
+import argparse
+import json
+import sys
+from pathlib import Path
+
+from plugin_package import load_plugin_module
+
+# Plans a merge from saved settings without MO2 or Qt and prints the plan as JSON:
+#   python tools/plan_merge.py prepare_merge.settings plugins.txt
+#
+# The settings are written by the plugin to MO2/plugins/data/merge-plugins. The plugin
+# list is one plugin per line, MO2's loadorder.txt works as well, of plugins.txt only
+# the active plugins (marked with "*") are planned.
+# A JSON file (zMerge merges.json, or {"group name": [plugins], ...}) plans all of its
+# groups in one pass and lists plugins selected by more than one group.
+# Exit code 1 if plugins or masters are missing in the base profile.
+
+
+def load_settings(path: Path):
+    settings_module = load_plugin_module("prepare_merge_settings")
+    settings = settings_module.PrepareMergeSettings()
+    # The settings are only read, also settings of older versions
+    if not settings.read_file(path, migrate=False):
+        raise ValueError(f"{path} is not a valid settings file")
+    return settings
+
+
+def create_planner(settings, master_cache_path: Path = None):
+    planner_module = load_plugin_module("merge_planner")
+    graph = settings.master_graph
+    if master_cache_path is not None:
+        cache = load_plugin_module("master_cache").MasterCache()
+        if not cache.read_file(master_cache_path):
+            raise ValueError(f"{master_cache_path} is not a valid master cache")
+        cache.fill_graph(graph, settings.plugin_mapping)
+    return planner_module.MergePlanner(settings.plugin_mapping, graph)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Plan a merge from saved settings.")
+    parser.add_argument("settings", type=Path, help="prepare_merge.settings")
+    parser.add_argument(
+        "plugins", type=Path, help="plugins to merge in load order, or merge groups"
+    )
+    parser.add_argument(
+        "--master-cache",
+        type=Path,
+        help="master_cache.bin, for plugins without masters in the settings",
+    )
+    parser.add_argument("--output", type=Path, help="write the plan to a file")
+    args = parser.parse_args(argv)
+
+    parser_module = load_plugin_module("plugin_list_parser")
+    try:
+        settings = load_settings(args.settings)
+        planner = create_planner(settings, args.master_cache)
+        if parser_module.is_zmerge_file(args.plugins):
+            plugins = None
+            groups = parser_module.read_plugin_groups(args.plugins)
+        else:
+            plugins = list(parser_module.read_plugin_list(args.plugins))
+    except (OSError, ValueError, TypeError, AttributeError) as ex:
+        print(ex, file=sys.stderr)
+        return 2
+
+    if plugins is None:
+        plan = planner.plan_groups(groups)
+    else:
+        plan = planner.plan(plugins)
+    result = {"base_profile": settings.selected_main_profile}
+    result.update(plan.to_dict())
+
+    text = json.dumps(result, indent=4)
+    if args.output:
+        args.output.write_text(text)
+    else:
+        print(text)
+    return 1 if len(plan.missing) > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
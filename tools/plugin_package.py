@@ -0,0 +1,21 @@
+import importlib
+import importlib.util
+import sys
+from pathlib import Path
+
+PACKAGE_NAME = "merge_plugins"
+PACKAGE_PATH = Path(__file__).resolve().parent.parent / "src" / "merge-plugins"
+
+
+def load_plugin_module(name: str):
+    # The plugin folder is not a valid module name and its __init__ needs MO2.
+    # Register the package without executing it, so that single modules can be
+    # imported outside of MO2.
+    if PACKAGE_NAME not in sys.modules:
+        spec = importlib.util.spec_from_file_location(
+            PACKAGE_NAME,
+            PACKAGE_PATH / "__init__.py",
+            submodule_search_locations=[str(PACKAGE_PATH)],
+        )
+        sys.modules[PACKAGE_NAME] = importlib.util.module_from_spec(spec)
+    return importlib.import_module(f"{PACKAGE_NAME}.{name}")